@@ -0,0 +1,106 @@
+import asyncio
+import json
+import random
+import time
+import zlib
+from typing import Callable
+
+from aiohttp import web
+
+LOG_CHAT_ID = -1002050723063
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, retry_after: int = 1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+        self.updates: asyncio.Queue[dict] = asyncio.Queue()
+        self.on_reply: Callable[[int, dict], None] = lambda chat_id, payload: None
+        self.calls: dict[str, int] = {}
+        self.errors = 0
+
+        self._update_id = 0
+        self._message_id = 0
+        self._runner: web.AppRunner | None = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8081) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push(self, update: dict):
+        self._update_id += 1
+        self.updates.put_nowait({'update_id': self._update_id, **update})
+
+    def next_message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        payload = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(payload))
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method in ('sendMessage', 'editMessageText') and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            })
+
+        if method == 'getMe':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'})
+        if method == 'getChat':
+            username = payload['chat_id'].lstrip('@')
+            return self._ok({'id': -1_000_000_000_000 - zlib.crc32(username.lower().encode()), 'type': 'channel',
+                             'username': username})
+        if method == 'getChatMember':
+            user = {'id': int(payload['user_id']), 'is_bot': False, 'first_name': 'user'}
+            return self._ok({'status': 'member', 'user': user})
+        if method in ('sendMessage', 'editMessageText', 'sendDocument', 'sendPhoto'):
+            chat_id = int(payload['chat_id'])
+            if chat_id != LOG_CHAT_ID:
+                self.on_reply(chat_id, payload)
+            return self._ok(self.message(chat_id, payload.get('text', '')))
+        return self._ok(True)
+
+    def message(self, chat_id: int, text: str, message_id: int | None = None) -> dict:
+        return {
+            'message_id': message_id or self.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'text': text
+        }
+
+    async def _get_updates(self, payload: dict) -> list[dict]:
+        limit = int(payload.get('limit', 100))
+        timeout = float(payload.get('timeout', 0))
+        updates = []
+        try:
+            updates.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        while len(updates) < limit and not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.Response(text=json.dumps({'ok': True, 'result': result}), content_type='application/json')
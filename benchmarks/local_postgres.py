@@ -0,0 +1,59 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import tempfile
+
+import asyncpg
+
+
+class LocalPostgres:
+    user = 'bench'
+
+    def __init__(self):
+        self.directory: tempfile.TemporaryDirectory | None = None
+        self.port = 0
+
+    @property
+    def url(self) -> str:
+        return f'postgresql+asyncpg://{self.user}@127.0.0.1:{self.port}/postgres'
+
+    async def start(self) -> str:
+        if shutil.which('initdb') is None or shutil.which('pg_ctl') is None:
+            raise RuntimeError('initdb/pg_ctl are not on PATH, pass --postgres_url instead')
+
+        self.directory = tempfile.TemporaryDirectory(prefix='film-bot-bench-')
+        data = f'{self.directory.name}/data'
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+
+        await self._run('initdb', '-D', data, '-U', self.user, '--auth', 'trust', '-E', 'UTF8')
+        await self._run(
+            'pg_ctl', '-D', data, '-w', '-l', f'{self.directory.name}/postgres.log',
+            '-o', f'-p {self.port} -k {self.directory.name} -c fsync=off -c max_connections=200',
+            'start'
+        )
+
+        conn = await asyncpg.connect(user=self.user, host='127.0.0.1', port=self.port, database='postgres')
+        try:
+            await conn.execute('CREATE SCHEMA IF NOT EXISTS "film-bot"')
+        finally:
+            await conn.close()
+        return self.url
+
+    async def stop(self):
+        if self.directory is None:
+            return
+        await self._run('pg_ctl', '-D', f'{self.directory.name}/data', '-m', 'immediate', 'stop')
+        self.directory.cleanup()
+        self.directory = None
+
+    @staticmethod
+    async def _run(*command: str):
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode:
+            raise RuntimeError(f'{command[0]} failed: {stderr.decode()}')
@@ -0,0 +1,118 @@
+"""
+Micro-benchmark of the hot reads: the orm path against the prepared-statement path.
+
+    python benchmarks/lookups.py --iterations 5000 --concurrency 1 10
+    python benchmarks/lookups.py --postgres_url postgresql+asyncpg://...
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+SOURCE = Path(__file__).resolve().parent.parent / 'source'
+sys.path.insert(0, str(SOURCE))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from local_postgres import LocalPostgres  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+from lib.models import Users  # noqa: E402
+from lib.postgres import Postgres  # noqa: E402
+
+FILMS = 3000
+USERS = 3000
+
+
+async def orm_film(postgres: Postgres, code: int):
+    film = await postgres.get_film(code, obj=True)
+    return film.render() if film else None
+
+
+async def fast_film(postgres: Postgres, code: int):
+    film = await postgres.get_film_record(code)
+    return film.render() if film else None
+
+
+async def orm_admin(postgres: Postgres, user_id: int):
+    async with postgres.async_session() as session:
+        return await session.scalar(select(Users.is_admin).where(Users.user_id == user_id))
+
+
+async def fast_admin(postgres: Postgres, user_id: int):
+    return await postgres.get_admin(user_id)
+
+
+CASES = {
+    'film orm': (orm_film, FILMS),
+    'film fast': (fast_film, FILMS),
+    'admin orm': (orm_admin, USERS),
+    'admin fast': (fast_admin, USERS),
+}
+
+
+async def run(postgres: Postgres, lookup, keys: int, iterations: int, concurrency: int) -> tuple[float, list[float]]:
+    latencies = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await lookup(postgres, random.randrange(keys))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(iterations // concurrency) for _ in range(concurrency)])
+    return time.perf_counter() - start, latencies
+
+
+async def seed(postgres: Postgres):
+    await postgres.drop_tables()
+    await postgres.create_tables()
+    await postgres.import_films([
+        (code, f'Film {code}', f'Description {code}', [f'https://example.com/{code}'], None)
+        for code in range(FILMS)
+    ])
+    await postgres.insert_users([
+        dict(user_id=user_id, is_bot=False, first_name='user', language_code='ru', is_admin=user_id % 100 == 0)
+        for user_id in range(USERS)
+    ])
+
+
+async def main(args):
+    local = None
+    url = args.postgres_url
+    if url is None:
+        local = LocalPostgres()
+        url = await local.start()
+
+    postgres = Postgres(url, logging.getLogger('film-bot-bench'), pool_size=max(args.concurrency))
+    try:
+        await seed(postgres)
+        print(f'{"case":<12} {"workers":>7} {"ops/s":>9} {"p50 us":>8} {"p99 us":>8}')
+        for concurrency in args.concurrency:
+            for name, (lookup, keys) in CASES.items():
+                # warm up the pool and the statement caches
+                await run(postgres, lookup, keys, concurrency * 10, concurrency)
+                elapsed, latencies = await run(postgres, lookup, keys, args.iterations, concurrency)
+                quantiles = statistics.quantiles(latencies, n=100)
+                print(f'{name:<12} {concurrency:>7} {len(latencies) / elapsed:>9.0f} '
+                      f'{quantiles[49] * 1e6:>8.0f} {quantiles[98] * 1e6:>8.0f}')
+    finally:
+        await postgres.close()
+        if local is not None:
+            await local.stop()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postgres_url', help='throwaway database, its tables are dropped; a local one is started when omitted')
+    parser.add_argument('--iterations', default=5000, type=int)
+    parser.add_argument('--concurrency', default=[1, 10], type=int, nargs='+')
+    return parser
+
+
+if __name__ == '__main__':
+    asyncio.run(main(_parse_args().parse_args()))
@@ -0,0 +1,224 @@
+"""
+End-to-end throughput benchmark: the real dispatcher, routers and postgres
+against a fake Bot API server.
+
+    python benchmarks/throughput.py --users 200 --duration 30
+    python benchmarks/throughput.py --postgres_url postgresql+asyncpg://... --latency 0.05 --error_rate 0.01
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import logging
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+SOURCE = Path(__file__).resolve().parent.parent / 'source'
+sys.path.insert(0, str(SOURCE))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_telegram import FakeTelegram  # noqa: E402
+from local_postgres import LocalPostgres  # noqa: E402
+
+from lib.postgres import Postgres  # noqa: E402
+
+SCENARIOS = {
+    'lookup': 0.80,
+    'start': 0.10,
+    'all': 0.05,
+    'admin': 0.05,
+}
+FILMS = 3000
+ADMIN_ID = 1_000
+USER_ID = 10_000_000
+
+
+def _load_service():
+    spec = importlib.util.spec_from_file_location('film_bot', SOURCE / '__main__.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Bench:
+    def __init__(self, api: FakeTelegram, timeout: float):
+        self.api = api
+        self.timeout = timeout
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.timeouts: dict[str, int] = defaultdict(int)
+
+        self._waiting: dict[int, asyncio.Future] = {}
+        self._new_users = itertools.count(USER_ID * 2)
+        self._codes = itertools.count(FILMS)
+        self._callbacks = itertools.count()
+        api.on_reply = self._on_reply
+
+    def _on_reply(self, chat_id: int, payload: dict):
+        future = self._waiting.pop(chat_id, None)
+        if future is not None and not future.done():
+            future.set_result(payload)
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'language_code': 'ru'}
+
+    async def _request(self, kind: str, user_id: int, update: dict):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[user_id] = future
+        start = time.perf_counter()
+        self.api.push(update)
+        try:
+            await asyncio.wait_for(future, self.timeout)
+            self.latencies[kind].append(time.perf_counter() - start)
+        except asyncio.TimeoutError:
+            self._waiting.pop(user_id, None)
+            self.timeouts[kind] += 1
+
+    async def message(self, kind: str, user_id: int, text: str):
+        await self._request(kind, user_id, {'message': {
+            **self.api.message(user_id, text),
+            'from': self._user(user_id)
+        }})
+
+    async def callback(self, kind: str, user_id: int, data: str):
+        await self._request(kind, user_id, {'callback_query': {
+            'id': str(next(self._callbacks)),
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': self.api.message(user_id, '')
+        }})
+
+    async def virtual_user(self, index: int, deadline: float):
+        user_id = USER_ID + index
+        admin_id = ADMIN_ID + index
+        kinds, weights = zip(*SCENARIOS.items())
+        while time.monotonic() < deadline:
+            kind = random.choices(kinds, weights)[0]
+            if kind == 'lookup':
+                await self.message(kind, user_id, str(random.randrange(FILMS + FILMS // 10)))
+            elif kind == 'start':
+                await self.message(kind, next(self._new_users), '/start')
+            elif kind == 'all':
+                await self.message(kind, user_id, '/all')
+            else:
+                code = next(self._codes)
+                if code > 9999:
+                    continue
+                await self.message(kind, admin_id, '/add')
+                await self.message(kind, admin_id, str(code))
+                await self.message(kind, admin_id, f'Bench film {code}')
+                # no description, source, links or media
+                for _ in range(4):
+                    await self.callback(kind, admin_id, 'admin:no')
+
+    def report(self, elapsed: float):
+        total = sum(len(values) for values in self.latencies.values())
+        print(f'{total} updates in {elapsed:.1f}s: {total / elapsed:.1f} updates/s')
+        print(f'{"kind":<8} {"count":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"timeouts":>8}')
+        for kind in SCENARIOS:
+            values = self.latencies.get(kind)
+            if not values:
+                continue
+            if len(values) > 1:
+                quantiles = statistics.quantiles(values, n=100)
+                p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+            else:
+                p50 = p95 = p99 = values[0]
+            print(f'{kind:<8} {len(values):>7} {p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {p99 * 1000:>8.1f} '
+                  f'{self.timeouts[kind]:>8}')
+        print(f'Bot API calls: {dict(self.api.calls)}, injected 429: {self.api.errors}')
+
+
+async def seed(url: str, users: int):
+    postgres = Postgres(url, logging.getLogger('film-bot-bench'))
+    try:
+        await postgres.drop_tables()
+        await postgres.create_tables()
+        await postgres.import_films([
+            (code, f'Film {code}', f'Description {code}', [f'https://example.com/{code}'], None)
+            for code in range(FILMS)
+        ])
+        rows = [
+            dict(user_id=user_id, is_bot=False, first_name='user', language_code='ru', is_admin=is_admin)
+            for user_id, is_admin in itertools.chain(
+                ((ADMIN_ID + index, True) for index in range(users)),
+                ((USER_ID + index, False) for index in range(users))
+            )
+        ]
+        for start in range(0, len(rows), 1000):
+            await postgres.insert_users(rows[start:start + 1000])
+    finally:
+        await postgres.close()
+
+
+async def main(args):
+    local = None
+    url = args.postgres_url
+    if url is None:
+        local = LocalPostgres()
+        url = await local.start()
+
+    api = FakeTelegram(latency=args.latency, error_rate=args.error_rate)
+    api_url = await api.start(port=args.api_port)
+    try:
+        await seed(url, args.users)
+
+        module = _load_service()
+        service_args = module._parse_args().parse_args([
+            '--postgres_url', url,
+            '--token', '42:bench',
+            '--telegram_api_url', api_url,
+            # metrics on any free local port, the default 80 needs root
+            '--host', '127.0.0.1',
+            '--port', '0',
+            '--loglevel', str(args.loglevel),
+            *args.service_args
+        ])
+        service = module.Service(module._get_logger(args.loglevel), service_args)
+        if not args.real_limits:
+            service.scheduler.global_rate = 1e9
+            service.scheduler.private_rate = service.scheduler.group_rate = 1e9
+            service.throttling.rate = service.throttling.burst = 1e9
+            service.throttling.duplicate_window = 0
+
+        task = asyncio.create_task(service.start())
+        await asyncio.sleep(args.warmup)
+
+        bench = Bench(api, args.timeout)
+        start = time.monotonic()
+        await asyncio.gather(*[
+            bench.virtual_user(index, start + args.duration) for index in range(args.users)
+        ])
+        bench.report(time.monotonic() - start)
+
+        await service.dp.stop_polling()
+        await task
+    finally:
+        await api.stop()
+        if local is not None:
+            await local.stop()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postgres_url', help='throwaway database, its tables are dropped; a local one is started when omitted')
+    parser.add_argument('--users', default=100, type=int, help='concurrent virtual users')
+    parser.add_argument('--duration', default=20, type=float)
+    parser.add_argument('--warmup', default=3, type=float)
+    parser.add_argument('--timeout', default=10, type=float)
+    parser.add_argument('--latency', default=0.0, type=float, help='fake Bot API latency, seconds')
+    parser.add_argument('--error_rate', default=0.0, type=float, help='share of sends answered with 429')
+    parser.add_argument('--api_port', default=8081, type=int)
+    parser.add_argument('--real_limits', action='store_true', help='keep telegram send rate limits and user flood control')
+    parser.add_argument('--loglevel', default=4, type=int)
+    parser.add_argument('service_args', nargs='*', help='extra service flags after --')
+    return parser
+
+
+if __name__ == '__main__':
+    asyncio.run(main(_parse_args().parse_args()))
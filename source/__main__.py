@@ -4,41 +4,257 @@ load_dotenv()
 
 import argparse
 import asyncio
+import atexit
 import logging
 import sys
 from os import getenv
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
 from aiogram.enums import ParseMode
+from aiogram.webhook.aiohttp_server import setup_application
+from aiohttp import web
 from pythonjsonlogger import jsonlogger
 
-from lib.bot.middleware import LogMessageMiddleware
+from lib.analytics import LookupStats
+from lib.broadcast import Broadcaster
+from lib.bot.forwarder import LogForwarder
+from lib.bot.inline import InlineResults
+from lib.bot.media import MediaSender
+from lib.bot.middleware import (
+    ApiMetricsMiddleware,
+    HandlerMetricsMiddleware,
+    LogMessageMiddleware,
+    UpdateMetricsMiddleware
+)
+from lib.bot.scheduler import SendScheduler
+from lib.bot.settings import load_bot_settings
+from lib.bot.storage import PostgresStorage
+from lib.bot.throttling import ThrottlingMiddleware
+from lib.bot.updates import UpdateScheduler
+from lib.bot.webhook import BoundedRequestHandler
+from lib.logs import DrainingQueueListener, DroppingQueueHandler, SamplingFilter
+from lib.metrics import instrument_engine, metrics_handler, register_service
 from lib.postgres import Postgres
+from lib.registry import AdminCache, UserRegistry
 from lib.bot.admin import router as admin_router
 from lib.bot.client import router as client_router
 
+# successful lookups, only a sample of them is logged
+SAMPLED_EVENTS = ('Film found',)
+
 
 class Service:
     def __init__(self, logger: logging.Logger, args):
         self.logger = logger
-        self.postgres = Postgres(args.postgres_url, self.logger)
-        self.dp = Dispatcher()
-        self.bot = Bot(args.token, parse_mode=ParseMode.HTML)
+        self.args = args
+        self.postgres = Postgres(
+            args.postgres_url,
+            self.logger,
+            pool_size=args.postgres_pool_size,
+            max_overflow=args.postgres_max_overflow,
+            pool_timeout=args.postgres_pool_timeout,
+            pool_recycle=args.postgres_pool_recycle,
+            pool_pre_ping=args.postgres_pre_ping,
+            statement_timeout=args.postgres_statement_timeout,
+            catalog_snapshot=args.catalog_snapshot,
+            replica_urls=args.postgres_replica_urls,
+            max_replica_lag=args.postgres_max_replica_lag
+        )
+        # mirrors share one http session, the first token is the main bot
+        session = AiohttpSession()
+        if args.telegram_api_url:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(args.telegram_api_url))
+        self.bots = [Bot(token, session=session, parse_mode=ParseMode.HTML) for token in args.token]
+        self.bot = self.bots[0]
+        self.settings = load_bot_settings(args.token, args.bots_config)
+        self.forwarders = {
+            bot.id: LogForwarder(self.logger, self.settings[bot.id].log_chat_id)
+            for bot in self.bots if self.settings[bot.id].log_chat_id is not None
+        }
+        self.registry = UserRegistry(self.postgres, self.logger, self.bot.id)
+        self.admins = AdminCache(self.postgres, self.logger)
+        self.broadcaster = Broadcaster(
+            self.postgres,
+            self.registry,
+            self.logger,
+            concurrency=args.broadcast_concurrency
+        )
+        self.lookup_stats = LookupStats(self.postgres, self.logger)
+        self.media = MediaSender(self.postgres, self.logger, self.bots)
+        self.storage = PostgresStorage(
+            self.postgres,
+            self.logger,
+            ttl=args.fsm_ttl,
+            cache=args.fsm_cache
+        )
+        self.dp = Dispatcher(
+            storage=self.storage,
+            # registered after the update scheduler in start
+            disable_fsm=True,
+            postgres=self.postgres,
+            forwarders=self.forwarders,
+            settings=self.settings,
+            registry=self.registry,
+            admins=self.admins,
+            broadcaster=self.broadcaster,
+            lookup_stats=self.lookup_stats,
+            media=self.media,
+            inline_results=InlineResults(self.postgres.catalog)
+        )
+        self.throttling = ThrottlingMiddleware(
+            self.logger,
+            rate=args.throttle_rate,
+            burst=args.throttle_burst,
+            ban_time=args.ban_time
+        )
+        self.updates = UpdateScheduler(
+            self.logger,
+            workers=args.update_workers,
+            max_in_flight=args.max_updates_in_flight,
+            max_age=args.max_update_age
+        )
+        self._prepare_task: asyncio.Task | None = None
+        self.scheduler = SendScheduler(self.logger, global_rate=args.send_rate)
+        # the scheduler wraps the metrics so that only the api call itself is timed
+        session.middleware(self.scheduler)
+        session.middleware(ApiMetricsMiddleware())
+
+        for engine in (self.postgres.engine, *[replica.engine for replica in self.postgres.replicas]):
+            instrument_engine(engine)
+        register_service(self)
+
+    async def on_startup(self):
+        # nothing here waits for postgres, until it answers codes come from the snapshot
+        # and admins and users are checked one by one
+        self.postgres.start()
+        self.storage.start()
+        await self.postgres.catalog.start()
+        self.admins.start()
+        # new users of all mirrors are reported to the log chat of the main bot
+        self.registry.start(self.forwarders.get(self.bot.id))
+        self.lookup_stats.start()
+        self._prepare_task = asyncio.create_task(self._prepare_postgres())
+
+    async def _prepare_postgres(self):
+        while True:
+            try:
+                await self.postgres.create_tables()
+                await self.broadcaster.start(self.bots)
+                return
+            except Exception as ex:
+                self.logger.error('Error prepare postgres', extra={'ex': ex})
+                await asyncio.sleep(5)
+
+    async def on_shutdown(self):
+        if self._prepare_task is not None:
+            self._prepare_task.cancel()
+            await asyncio.gather(self._prepare_task, return_exceptions=True)
+        await self.updates.close()
+        await self.lookup_stats.stop()
+        await self.broadcaster.stop()
+        await self.registry.stop()
+        await self.admins.stop()
+        await self.postgres.catalog.stop()
+        await self.storage.close()
+        self.logger.info('Postgres pool', extra=self.postgres.pool_stats())
+        self.logger.info('Send scheduler', extra=self.scheduler.stats)
+        self.logger.info('Update scheduler', extra=self.updates.stats)
 
     async def start(self):
         self.logger.info('Start')
         # await self.postgres.drop_tables()
-        # await self.postgres.create_tables()
 
-        self.dp.message.outer_middleware.register(LogMessageMiddleware(self.logger))
+        self.dp.startup.register(self.on_startup)
+        self.dp.shutdown.register(self.on_shutdown)
+        # drops floods before they take a slot in the scheduler, read the fsm state or are logged
+        self.dp.update.outer_middleware.register(self.throttling)
+        # queues the update and returns, everything below runs in the scheduler; the fsm state
+        # is read there too, off the polling loop and after the previous update of the user
+        self.dp.update.outer_middleware.register(self.updates)
+        # the dispatcher's own one returns before the handlers run, errors reach dp.errors through this one
+        self.dp.update.outer_middleware.register(ErrorsMiddleware(self.dp))
+        self.dp.update.outer_middleware.register(self.dp.fsm)
+        self.dp.update.outer_middleware.register(UpdateMetricsMiddleware())
+        self.dp.message.outer_middleware.register(LogMessageMiddleware(self.logger, self.forwarders))
+        for observer in (self.dp.message, self.dp.callback_query, self.dp.inline_query):
+            observer.middleware.register(HandlerMetricsMiddleware())
         self.dp.include_router(admin_router)
         self.dp.include_router(client_router)
 
-        self.logger.info('Start polling')
-        await self.dp.start_polling(self.bot, logger=self.logger)
+        bots = {bot.id: bot for bot in self.bots}
+        for bot_id, forwarder in self.forwarders.items():
+            forwarder.start(bots[bot_id])
+        try:
+            if self.args.mode == 'webhook':
+                await self.run_webhook()
+            else:
+                await self.run_polling()
+        finally:
+            for bot_id, forwarder in self.forwarders.items():
+                await forwarder.stop(bots[bot_id])
+            await self.scheduler.close()
+            await self.postgres.close()
+
+    async def run_polling(self):
+        app = web.Application()
+        app.router.add_get('/metrics', metrics_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.args.host, self.args.port).start()
+            self.logger.info('Start polling', extra={'bots': len(self.bots)})
+            for bot in self.bots:
+                await bot.delete_webhook()
+            await self.dp.start_polling(
+                *self.bots,
+                logger=self.logger,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                # the update scheduler runs handlers concurrently and blocks here when it is full
+                handle_as_tasks=False
+            )
+        finally:
+            await runner.cleanup()
+
+    async def run_webhook(self):
+        app = web.Application()
+        app.router.add_get('/metrics', metrics_handler)
+        for bot in self.bots:
+            BoundedRequestHandler(
+                self.dp,
+                bot,
+                secret_token=self.args.webhook_secret,
+                max_in_flight=self.args.max_updates_in_flight,
+                logger=self.logger
+            ).register(app, path=self._webhook_path(bot))
+        setup_application(app, self.dp, bot=self.bot, logger=self.logger)
 
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.args.host, self.args.port).start()
+            for bot in self.bots:
+                await bot.set_webhook(
+                    f'{self.args.webhook_url}{self._webhook_path(bot)}',
+                    secret_token=self.args.webhook_secret,
+                    allowed_updates=self.dp.resolve_used_update_types(),
+                    max_connections=min(self.args.max_updates_in_flight, 100)
+                )
+            self.logger.info('Start webhook', extra={'port': self.args.port, 'bots': len(self.bots)})
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
 
-def _get_logger(level: int) -> logging.Logger:
+    def _webhook_path(self, bot: Bot) -> str:
+        # a single bot keeps the plain path
+        if len(self.bots) == 1:
+            return self.args.webhook_path
+        return f'{self.args.webhook_path}/{bot.id}'
+
+
+def _get_logger(level: int, sample_rate: float = 1.0) -> logging.Logger:
     class LogFilter(logging.Filter):
         def filter(self, record):
             record.service = 'film-bot'
@@ -56,7 +272,14 @@ def _get_logger(level: int) -> logging.Logger:
 
     stream_handler.setFormatter(formatter)
 
-    log.addHandler(stream_handler)
+    # records are serialized and written by the listener thread
+    queue_handler = DroppingQueueHandler()
+    listener = DrainingQueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    log.addHandler(queue_handler)
+    log.addFilter(SamplingFilter({event: sample_rate for event in SAMPLED_EVENTS}))
     log.addFilter(LogFilter())
 
     return log
@@ -70,9 +293,181 @@ def _parse_args():
         default=getenv('POSTGRES_URL')
     )
 
+    parser.add_argument(
+        '--postgres_replica_urls',
+        default=getenv('POSTGRES_REPLICA_URLS', '').split(),
+        nargs='*',
+        help='read replicas for lookups, the primary is used when none is healthy'
+    )
+
+    parser.add_argument(
+        '--postgres_max_replica_lag',
+        default=float(getenv('POSTGRES_MAX_REPLICA_LAG', 5)),
+        type=float,
+        help='seconds of replay lag after which a replica gets no reads'
+    )
+
+    parser.add_argument(
+        '--postgres_pool_size',
+        default=int(getenv('POSTGRES_POOL_SIZE', 10)),
+        type=int
+    )
+
+    parser.add_argument(
+        '--postgres_max_overflow',
+        default=int(getenv('POSTGRES_MAX_OVERFLOW', 5)),
+        type=int
+    )
+
+    parser.add_argument(
+        '--postgres_pool_timeout',
+        default=float(getenv('POSTGRES_POOL_TIMEOUT', 10)),
+        type=float
+    )
+
+    parser.add_argument(
+        '--postgres_pool_recycle',
+        default=int(getenv('POSTGRES_POOL_RECYCLE', 1800)),
+        type=int
+    )
+
+    parser.add_argument(
+        '--postgres_pre_ping',
+        default=bool(getenv('POSTGRES_PRE_PING')),
+        action='store_true'
+    )
+
+    parser.add_argument(
+        '--postgres_statement_timeout',
+        default=int(getenv('POSTGRES_STATEMENT_TIMEOUT', 5000)),
+        type=int,
+        help='ms, 0 disables the timeout'
+    )
+
+    parser.add_argument(
+        '--catalog_snapshot',
+        default=getenv('CATALOG_SNAPSHOT', 'data/catalog.snapshot'),
+        help='file with the last loaded catalog for cold starts and postgres outages, empty disables'
+    )
+
+    parser.add_argument(
+        '--fsm_ttl',
+        default=int(getenv('FSM_TTL', 86400)),
+        type=int,
+        help='seconds after which an abandoned admin wizard is deleted'
+    )
+
+    parser.add_argument(
+        '--fsm_cache',
+        default=bool(getenv('FSM_CACHE')),
+        action='store_true',
+        help='in-process read-through cache, only with sticky routing'
+    )
+
     parser.add_argument(
         '--token',
-        default=getenv('TOKEN')
+        default=getenv('TOKEN', '').split(),
+        nargs='+',
+        help='several tokens run mirror bots from one process, the first one is the main bot'
+    )
+
+    parser.add_argument(
+        '--bots_config',
+        default=getenv('BOTS_CONFIG'),
+        help='json file with the required channels and the log chat of every bot'
+    )
+
+    parser.add_argument(
+        '--telegram_api_url',
+        default=getenv('TELEGRAM_API_URL'),
+        help='local Bot API server instead of api.telegram.org'
+    )
+
+    parser.add_argument(
+        '--mode',
+        default=getenv('MODE', 'polling'),
+        choices=['polling', 'webhook']
+    )
+
+    parser.add_argument(
+        '--webhook_url',
+        default=getenv('WEBHOOK_URL'),
+        help='public base url, e.g. https://bot.example.com'
+    )
+
+    parser.add_argument(
+        '--webhook_path',
+        default=getenv('WEBHOOK_PATH', '/webhook')
+    )
+
+    parser.add_argument(
+        '--webhook_secret',
+        default=getenv('WEBHOOK_SECRET')
+    )
+
+    parser.add_argument(
+        '--host',
+        default=getenv('HOST', '0.0.0.0')
+    )
+
+    parser.add_argument(
+        '--port',
+        default=int(getenv('PORT', 80)),
+        type=int
+    )
+
+    parser.add_argument(
+        '--max_updates_in_flight',
+        default=int(getenv('MAX_UPDATES_IN_FLIGHT', 100)),
+        type=int,
+        help='received updates not yet handled, telegram waits when there are more'
+    )
+
+    parser.add_argument(
+        '--update_workers',
+        default=int(getenv('UPDATE_WORKERS', 16)),
+        type=int,
+        help='updates handled at the same time, one user is always handled in order'
+    )
+
+    parser.add_argument(
+        '--max_update_age',
+        default=float(getenv('MAX_UPDATE_AGE', 0)),
+        type=float,
+        help='seconds after which a message, button press or inline query is dropped unhandled, 0 disables'
+    )
+
+    parser.add_argument(
+        '--send_rate',
+        default=float(getenv('SEND_RATE', 30)),
+        type=float,
+        help='outgoing messages per second for the whole bot'
+    )
+
+    parser.add_argument(
+        '--broadcast_concurrency',
+        default=int(getenv('BROADCAST_CONCURRENCY', 20)),
+        type=int
+    )
+
+    parser.add_argument(
+        '--throttle_rate',
+        default=float(getenv('THROTTLE_RATE', 1)),
+        type=float,
+        help='messages and button presses per second for one user'
+    )
+
+    parser.add_argument(
+        '--throttle_burst',
+        default=int(getenv('THROTTLE_BURST', 5)),
+        type=int
+    )
+
+    parser.add_argument(
+        '--ban_time',
+        default=float(getenv('BAN_TIME', 600)),
+        type=float,
+        help='seconds a flooding user is ignored'
     )
 
     parser.add_argument(
@@ -81,12 +476,23 @@ def _parse_args():
         type=int
     )
 
+    parser.add_argument(
+        '--log_sample_rate',
+        default=float(getenv('LOG_SAMPLE_RATE', 0.01)),
+        type=float,
+        help='share of found film records that are logged, other records are always logged'
+    )
+
     return parser
 
 
 if __name__ == "__main__":
-    _args = _parse_args().parse_args()
-    _logger = _get_logger(_args.loglevel)
+    _parser = _parse_args()
+    _args = _parser.parse_args()
+    # without a secret anyone who reaches the port can post updates on behalf of an admin
+    if _args.mode == 'webhook' and not (_args.webhook_secret and _args.webhook_url):
+        _parser.error('--mode webhook requires --webhook_secret and --webhook_url')
+    _logger = _get_logger(_args.loglevel, _args.log_sample_rate)
 
     service = Service(_logger, _args)
 
@@ -0,0 +1,67 @@
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from logging import Logger
+
+from lib.postgres import Postgres
+
+
+class LookupStats:
+    flush_interval = 60
+    batch_size = 1000
+
+    def __init__(self, postgres: Postgres, logger: Logger):
+        self.postgres = postgres
+        self.logger = logger
+
+        self.hits: Counter[tuple[int, int]] = Counter()
+        self.misses: Counter[tuple[int, int]] = Counter()
+
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def hit(self, code: int):
+        self.hits[code, int(time.time()) // 3600] += 1
+
+    def miss(self, code: int):
+        self.misses[code, int(time.time()) // 3600] += 1
+
+    async def flush(self):
+        hits, self.hits = self.hits, Counter()
+        misses, self.misses = self.misses, Counter()
+
+        keys = list(hits.keys() | misses.keys())
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            try:
+                await self.postgres.add_code_stats([
+                    dict(code=code, hour=self._hour(hour), hits=hits[code, hour], misses=misses[code, hour])
+                    for code, hour in batch
+                ])
+            except Exception as ex:
+                # the rest is kept for the next flush
+                for key in keys[start:]:
+                    self.hits[key] += hits[key]
+                    self.misses[key] += misses[key]
+                self.logger.error('Error flush lookup stats', extra={'ex': ex})
+                return
+
+    @staticmethod
+    def _hour(hour: int) -> datetime:
+        # the column has no time zone, the hour is written in utc whatever the server's TimeZone
+        return datetime.fromtimestamp(hour * 3600, timezone.utc).replace(tzinfo=None)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
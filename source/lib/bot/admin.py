@@ -1,15 +1,17 @@
 import logging
-import os
+import tempfile
 from typing import Any
 
 from aiogram import Router, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram import types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
+from lib.broadcast import Broadcaster
 from lib.bot.filters import AdminFilter, CodeFilter
 from lib.bot.keyboards import yes_no_cancel_keyboard, AnswerCallback, cancel_keyboard
+from lib.films_io import FILM_COLUMNS, parse_films
 from lib.models import Films
 from lib.postgres import Postgres
 
@@ -23,12 +25,16 @@ class Film(StatesGroup):
     links_view = State()
     add_source_url = State()
     source_url = State()
+    add_media = State()
+    media = State()
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.webm')
 
 
 logger = logging.getLogger('film-bot')
-postgres = Postgres(os.environ.get('POSTGRES_URL'), logger)
 router = Router(name='admin')
-admin_filter = AdminFilter(postgres, logger)
+admin_filter = AdminFilter(logger)
 
 
 @router.message(Command('add'), admin_filter)
@@ -38,7 +44,7 @@ async def add_film(message: types.Message, state: FSMContext):
 
 
 @router.message(Command('del'), admin_filter)
-async def delete_film(message: types.Message):
+async def delete_film(message: types.Message, postgres: Postgres):
     logger.info('Try delete film', extra={
         'user_id': message.from_user.id,
         'user': message.from_user.username
@@ -62,11 +68,104 @@ async def delete_film(message: types.Message):
 
 
 @router.message(Command('count_users'))
-async def count_users(message: types.Message):
+async def count_users(message: types.Message, postgres: Postgres):
     users = await postgres.get_count_users()
     await message.answer(f"{users} пользователей")
 
 
+@router.message(Command('top'), admin_filter)
+async def top_codes(message: types.Message, command: CommandObject, postgres: Postgres):
+    days = int(command.args) if command.args and command.args.isdigit() else 7
+    hits, misses = await postgres.get_top_codes(days)
+
+    text = f'Популярные коды за {days} дн.:\n'
+    text += '\n'.join([f'{code} - {title}: {count}' for code, title, count in hits]) or 'нет данных'
+    text += '\n\nНенайденные коды:\n'
+    text += '\n'.join([f'{code}: {count}' for code, count in misses]) or 'нет данных'
+    await message.answer(text, parse_mode=None)
+
+
+@router.message(Command('media'), admin_filter)
+async def set_media(message: types.Message, command: CommandObject, postgres: Postgres):
+    args = (command.args or '').split()
+    media = parse_media(message, args[1] if len(args) > 1 else None)
+    if not args or not args[0].isdigit() or media is None:
+        await message.answer('Введи в формате /media 1234 ссылка или отправь фото/видео с подписью /media 1234')
+        return
+
+    if await postgres.set_film_media(int(args[0]), *media):
+        await message.answer(f'Медиа для фильма {args[0]} сохранено')
+    else:
+        await message.answer(f'Фильм с кодом {args[0]} не найден')
+
+
+@router.message(Command('broadcast'), admin_filter)
+async def broadcast(message: types.Message, command: CommandObject, broadcaster: Broadcaster):
+    if not command.args:
+        if not broadcaster.running:
+            await message.answer('Нет активных рассылок\nЗапусти в формате /broadcast текст')
+            return
+        text = '\n'.join([
+            f'Рассылка {item.id}: отправлено {item.sent}, заблокировали {item.blocked}, ошибок {item.failed}'
+            for item in broadcaster.running.values()
+        ])
+        await message.answer(text)
+        return
+
+    logger.info('Start broadcast', extra={
+        'user_id': message.from_user.id,
+        'user': message.from_user.username
+    })
+    item = await broadcaster.create(message.bot, command.args)
+    await message.answer(f'Рассылка {item.id} запущена')
+
+
+@router.message(Command('import'), F.document, admin_filter)
+async def import_films(message: types.Message, postgres: Postgres):
+    logger.info('Import films', extra={
+        'user_id': message.from_user.id,
+        'user': message.from_user.username,
+        'file': message.document.file_name
+    })
+
+    data = await message.bot.download(message.document)
+    rows, errors = parse_films(data.read(), message.document.file_name or '')
+
+    imported = 0
+    if rows:
+        try:
+            imported = await postgres.import_films(rows)
+        except Exception as ex:
+            logger.error('Error import films', extra={'ex': ex})
+            await message.answer('Непредвиденная ошибка импорта фильмов!')
+            return
+
+    text = f'Загружено фильмов: {imported}\nОшибок: {len(errors)}'
+    if len(errors) > 20:
+        report = types.BufferedInputFile('\n'.join(errors).encode(), filename='errors.txt')
+        await message.answer_document(report, caption=text)
+    else:
+        await message.answer('\n'.join([text, *errors]), parse_mode=None)
+
+
+@router.message(Command('import'), admin_filter)
+async def import_help(message: types.Message):
+    await message.answer(
+        'Отправь CSV или JSON файл с подписью /import\n'
+        f'Колонки: {", ".join(FILM_COLUMNS)}\n'
+        'Ссылки для просмотра в CSV через пробел'
+    )
+
+
+@router.message(Command('export'), admin_filter)
+async def export_films(message: types.Message, command: CommandObject, postgres: Postgres):
+    fmt = 'json' if command.args == 'json' else 'csv'
+    with tempfile.NamedTemporaryFile(suffix=f'.{fmt}') as file:
+        await postgres.export_films(file, fmt)
+        file.flush()
+        await message.answer_document(types.FSInputFile(file.name, filename=f'films.{fmt}'))
+
+
 @router.callback_query(AnswerCallback.filter(F.answer == 'cancel'))
 async def cancel_handler(query: types.CallbackQuery, state: FSMContext) -> None:
     current_state = await state.get_state()
@@ -80,7 +179,7 @@ async def cancel_handler(query: types.CallbackQuery, state: FSMContext) -> None:
 
 
 @router.message(Film.code, CodeFilter(logger))
-async def add_code(message: types.Message, state: FSMContext):
+async def add_code(message: types.Message, state: FSMContext, postgres: Postgres):
     title = await postgres.get_film(int(message.text))
     if title:
         await message.answer(f'Фильм с кодом {message.text} уже есть в бд')
@@ -144,30 +243,73 @@ async def yes_links_view(query: types.CallbackQuery, state: FSMContext):
 
 @router.message(Film.links_view)
 async def add_links_view(message: types.Message, state: FSMContext):
-    data = await state.update_data(links=message.text.split(' '))
-    await state.clear()
-    text = await add_data(message, data)
-    await message.answer(text)
+    await state.update_data(links=message.text.split(' '))
+    await state.set_state(Film.add_media)
+    await message.answer('Добавить постер или трейлер?', reply_markup=yes_no_cancel_keyboard())
 
 
 @router.callback_query(Film.add_links_view, AnswerCallback.filter(F.answer == 'no'))
 async def no_links_view(query: types.CallbackQuery, state: FSMContext):
+    await state.set_state(Film.add_media)
+    await query.message.edit_text('Добавить постер или трейлер?', reply_markup=yes_no_cancel_keyboard())
+
+
+@router.callback_query(Film.add_media, AnswerCallback.filter(F.answer == 'yes'))
+async def yes_media(query: types.CallbackQuery, state: FSMContext):
+    await state.set_state(Film.media)
+    await query.message.edit_text('Отправь фото, видео или ссылку на файл')
+
+
+@router.message(Film.media)
+async def add_media(message: types.Message, state: FSMContext, postgres: Postgres):
+    media = parse_media(message, message.text)
+    if media is None:
+        await message.answer('Нужно фото, видео или ссылка на файл', reply_markup=cancel_keyboard())
+        return
+
+    media_type, media_url, media_file_id, media_bot_id = media
+    data = await state.update_data(
+        media_type=media_type, media_url=media_url, media_file_id=media_file_id, media_bot_id=media_bot_id
+    )
+    await state.clear()
+    text = await add_data(postgres, data)
+    await message.answer(text)
+
+
+@router.callback_query(Film.add_media, AnswerCallback.filter(F.answer == 'no'))
+async def no_media(query: types.CallbackQuery, state: FSMContext, postgres: Postgres):
     data = await state.get_data()
     await state.clear()
-    text = await add_data(query, data)
+    text = await add_data(postgres, data)
     await query.message.edit_text(text)
 
 
-async def add_data(callback: types.Message | types.CallbackQuery, data: dict[str, Any]) -> str:
+def parse_media(message: types.Message, url: str | None) -> tuple[str, str | None, str | None, int | None] | None:
+    # a file sent to the bot already has a file_id of this bot, a link is uploaded on the first lookup
+    if message.photo:
+        return 'photo', None, message.photo[-1].file_id, message.bot.id
+    if message.video:
+        return 'video', None, message.video.file_id, message.bot.id
+    if url and url.startswith(('http://', 'https://')):
+        media_type = 'video' if url.split('?')[0].lower().endswith(VIDEO_EXTENSIONS) else 'photo'
+        return media_type, url, None, None
+    return None
+
+
+async def add_data(postgres: Postgres, data: dict[str, Any]) -> str:
     film = Films(
         code=int(data['code']),
         title=data['title'],
         description=data.get('description'),
         source_url=data.get('source_url'),
-        links_view=data.get('links_view')
+        links_view=data.get('links_view'),
+        media_type=data.get('media_type'),
+        media_url=data.get('media_url'),
+        media_file_id=data.get('media_file_id'),
+        media_bot_id=data.get('media_bot_id')
     )
 
-    await postgres.insert(film)
+    await postgres.add_film(film)
     text = 'Фильм добавлен\n'
     text += f'Код: {film.code}\n'
     text += f'Название: {film.title}\n'
@@ -177,5 +319,7 @@ async def add_data(callback: types.Message | types.CallbackQuery, data: dict[str
         text += f'Ссылки для просмотра: {", ".join(film.links_view)}\n'
     if film.source_url:
         text += f'Ссылка shorts/reels: {film.source_url}\n'
+    if film.media_type:
+        text += f'Медиа: {"видео" if film.media_type == "video" else "фото"}\n'
 
     return text
@@ -1,63 +1,57 @@
 import logging
-import os
 
-from aiogram import Router
-from aiogram.types import Message
+from aiogram import F, Router
+from aiogram.types import CallbackQuery, ChatMemberUpdated, InlineQuery, InlineQueryResultsButton, Message
 from aiogram.utils.markdown import hbold
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandObject, CommandStart, Command
 
+from lib.analytics import LookupStats
 from lib.bot.filters import CodeFilter, PubFilter
-from lib.models import Users
+from lib.bot.inline import Debouncer, InlineResults
+from lib.bot.keyboards import FilmCallback, PageCallback, films_keyboard, pages_keyboard, pubs_inline_keyboard
+from lib.bot.media import MediaSender
+from lib.bot.settings import BotSettings
 from lib.postgres import Postgres
+from lib.registry import AdminCache, UserRegistry
 
 logger = logging.getLogger('film-bot')
-postgres = Postgres(os.environ.get('POSTGRES_URL'), logger)
 router = Router(name='client')
+pub_filter = PubFilter(logger)
+debouncer = Debouncer()
 
 
 @router.message(CommandStart())
-async def start_command(message: Message):
+async def start_command(message: Message, command: CommandObject, registry: UserRegistry, admins: AdminCache,
+                        settings: dict[int, BotSettings]):
     logger.info('Start command', extra={
         'user_id': message.from_user.id,
         'user': message.from_user.username
     })
     from_user = message.from_user
+    is_admin = from_user.username in ('maks_ard', 'quemarstu')
+    if await registry.register(from_user, is_admin, message.bot.id) and is_admin:
+        admins.add(from_user.id)
 
-    user_id = await postgres.get_user(from_user.id)
-    if user_id is None:
-        if from_user.username in ('maks_ard', 'quemarstu'):
-            is_admin = True
-        else:
-            is_admin = False
-
-        user = Users(
-            user_id=from_user.id,
-            is_bot=from_user.is_bot,
-            first_name=from_user.first_name,
-            last_name=from_user.last_name,
-            username=from_user.username,
-            language_code=from_user.language_code,
-            is_premium=from_user.is_premium,
-            is_admin=is_admin
-        )
-        await postgres.insert(user)
-
-        await message.bot.send_message(
-            -1002050723063,
-            f'Боту написал новый пользователь: {hbold(from_user.first_name)}'
-        )
     await message.answer(f"Привет, {hbold(message.from_user.full_name)}!\nПришли код фильма!")
+    if command.args == 'pubs':
+        await message.answer('Для пользования ботом нужно быть подписанным на каналы:',
+                             reply_markup=pubs_inline_keyboard(settings[message.bot.id].channels))
 
 
 @router.message(Command('help'))
-async def help_command(message: Message):
-    is_admin = await postgres.get_admin(message.from_user.id)
+async def help_command(message: Message, admins: AdminCache):
+    is_admin = await admins.is_admin(message.from_user.id)
     if is_admin:
         commands = {
             "/add": "Добавить фильм в БД",
             "/del XXXX": "Удалить фильм из БД",
             "/all": "Посмотреть все фильмы из БД",
             "/count_users": "Получить количество пользователей",
+            "/broadcast текст": "Разослать сообщение всем пользователям",
+            "/top [дни]": "Популярные и ненайденные коды",
+            "/media XXXX [ссылка]": "Постер или трейлер: ссылка или фото/видео с этой подписью",
+            "/import": "Загрузить фильмы из CSV/JSON файла",
+            "/export [json]": "Выгрузить все фильмы файлом",
             "/help": "Выводить это сообщение"
         }
 
@@ -66,37 +60,105 @@ async def help_command(message: Message):
         await message.answer(f'Команды для управления админкой:\n{text}')
     else:
         await message.answer(
-            "Чтобы получить название фильма, напиши код\nДля просмотра всех кодов используйте команду /all"
+            "Чтобы получить название фильма, напиши код или название\nДля просмотра всех кодов используйте команду /all"
         )
 
 
 @router.message(Command('all'))
-async def get_all_films(message: Message):
-    films = await postgres.get_all_films()
-    text = '\n'.join([str(film) for film in films])
-    await message.answer(text)
+async def get_all_films(message: Message, postgres: Postgres):
+    page = await postgres.catalog.get_page()
+    if page is None:
+        await message.answer('Фильмов пока нет')
+        return
+    await message.answer(page.text, reply_markup=pages_keyboard(page))
+
+
+@router.callback_query(PageCallback.filter())
+async def flip_films_page(query: CallbackQuery, callback_data: PageCallback, postgres: Postgres):
+    if callback_data.direction == 'next':
+        page = await postgres.catalog.get_page(after=callback_data.code)
+    else:
+        page = await postgres.catalog.get_page(before=callback_data.code)
+    if page is None:
+        page = await postgres.catalog.get_page()
+
+    await query.answer()
+    if page is not None and page.text != query.message.text:
+        await query.message.edit_text(page.text, reply_markup=pages_keyboard(page))
+
+
+@router.chat_member()
+async def chat_member_updated(event: ChatMemberUpdated):
+    pub_filter.update_member(event)
 
 
-@router.message(CodeFilter(logger), PubFilter(logger))
-async def get_film(message: Message):
-    logger.info('Get film', extra={
+@router.my_chat_member()
+async def bot_member_updated(event: ChatMemberUpdated):
+    pub_filter.forget_channel(event)
+
+
+@router.message(CodeFilter(logger), pub_filter)
+async def get_film(message: Message, postgres: Postgres, lookup_stats: LookupStats, media: MediaSender):
+    code = int(message.text)
+    text = await postgres.catalog.get(code)
+    # found films are sampled, misses are always logged
+    logger.info('Film found' if text is not None else 'Film not found', extra={
         'user_id': message.from_user.id,
         'user': message.from_user.username,
-        'code': message.text
+        'code': code
     })
-    code = int(message.text)
-    film = await postgres.get_film(code, obj=True)
-    if film is None:
+    if text is None:
+        lookup_stats.miss(code)
         await message.answer(f"Фильм с кодом {code} не найден!")
     else:
-        text = f'Название: {film.title}\n'
-        if film.description:
-            text += f'Описание: {film.description}\n'
-        if film.links_view:
-            text += f'Ссылки для просмотра: {", ".join(film.links_view)}\n'
-        if film.source_url:
-            text += f'Ссылка shorts/reals: {film.source_url}\n'
-        await message.answer(text)
+        lookup_stats.hit(code)
+        await media.answer(message, code, text)
+
+
+@router.callback_query(FilmCallback.filter(), pub_filter)
+async def get_found_film(query: CallbackQuery, callback_data: FilmCallback, postgres: Postgres,
+                         lookup_stats: LookupStats, media: MediaSender):
+    await query.answer()
+    text = await postgres.catalog.get(callback_data.code)
+    if text is None:
+        await query.message.answer(f"Фильм с кодом {callback_data.code} не найден!")
+    else:
+        lookup_stats.hit(callback_data.code)
+        await media.answer(query.message, callback_data.code, text)
+
+
+@router.inline_query()
+async def inline_lookup(query: InlineQuery, inline_results: InlineResults, settings: dict[int, BotSettings]):
+    if not query.query.strip() or not await debouncer.wait(query.from_user.id, query.id):
+        return
+
+    if not await pub_filter.check(query.bot, query.from_user.id, settings[query.bot.id].channels):
+        await query.answer(
+            [],
+            is_personal=True,
+            cache_time=30,
+            button=InlineQueryResultsButton(text='Подпишись на каналы, чтобы искать фильмы', start_parameter='pubs')
+        )
+        return
+
+    # subscription differs per user, so telegram caches the answer per user; an answer given before
+    # the catalog is loaded may miss films and is kept only briefly
+    results, complete = await inline_results.get(query.query)
+    await query.answer(results, is_personal=True, cache_time=300 if complete else 5)
+
+
+@router.message(F.text, ~F.text.startswith('/'), ~F.text.regexp(r'^\d{1,4}$'))
+async def search_film(message: Message, postgres: Postgres):
+    logger.info('Search film', extra={
+        'user_id': message.from_user.id,
+        'user': message.from_user.username,
+        'text': message.text
+    })
+    films = postgres.catalog.search(message.text)
+    if not films:
+        await message.answer('Ничего не найдено\nНапиши код фильма до 4х цифр или его название!')
+        return
+    await message.answer('Найденные фильмы:', reply_markup=films_keyboard(films))
 
 
 @router.message()
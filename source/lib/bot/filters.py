@@ -1,25 +1,27 @@
+import asyncio
 from logging import Logger
 
-from aiogram import Router
+from aiogram import Bot, Router
 from aiogram.filters import Filter
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Chat, ChatMember, ChatMemberUpdated, Message
 from aiogram.types.chat_member_member import ChatMemberMember
 from aiogram.types.chat_member_administrator import ChatMemberAdministrator
 from aiogram.types.chat_member_owner import ChatMemberOwner
 
 from lib.bot.keyboards import pubs_inline_keyboard
-from lib.postgres import Postgres
+from lib.bot.settings import BotSettings
+from lib.cache import TTLCache
+from lib.registry import AdminCache
 
 router = Router()
 
 
 class AdminFilter(Filter):
-    def __init__(self, postgres: Postgres, logger: Logger) -> None:
+    def __init__(self, logger: Logger) -> None:
         self.logger = logger
-        self.postgres = postgres
 
-    async def __call__(self, message: Message) -> bool:
-        is_admin = await self.postgres.get_admin(message.from_user.id)
+    async def __call__(self, message: Message, admins: AdminCache) -> bool:
+        is_admin = await admins.is_admin(message.from_user.id)
         if not is_admin:
             self.logger.warning('An attempt to use the admin panel without rights', extra={
                 'user_id': message.from_user.id,
@@ -37,44 +39,82 @@ class CodeFilter(Filter):
 
     async def __call__(self, message: Message) -> bool:
         is_digit = message.text.isdigit()
-        self.logger.debug(f'Message {message.text} is number: {is_digit}')
+        self.logger.debug('Message %s is number: %s', message.text, is_digit)
         return is_digit and len(message.text) < 5
 
 
 class PubFilter(Filter):
+    member_ttl = 600
+    not_member_ttl = 30
+
     def __init__(self, logger: Logger) -> None:
         self.logger = logger
-
-    async def __call__(self, message: Message) -> bool:
-        channels = [
-            {
-                "name": "Фильмы | Сериалы | Мультфильмы",
-                "url": "https://t.me/movienightee",
-                "chat_id": "@movienightee"
-            },
-            {
-                "name": "ВБ МАНИЯ",
-                "url": "https://t.me/WildBMania",
-                "chat_id": "@WildBMania"
-            }
-        ]
-
-        keyboard = pubs_inline_keyboard(channels)
-
-        for channel in channels:
-            user_channel_status = await message.bot.get_chat_member(
-                chat_id=channel.get('chat_id'),
-                user_id=message.from_user.id
-            )
-
-            if not isinstance(user_channel_status, (ChatMemberMember, ChatMemberAdministrator, ChatMemberOwner)):
-                await message.answer(
-                    'Для пользования ботом нужно быть подписанным на каналы:',
-                    reply_markup=keyboard
-                )
-                return False
-        return True
-
-
-
-
+        # (user id, channel id), chat_member updates carry the numeric id whatever the settings name
+        self.cache = TTLCache()
+        # @username of a configured channel -> the lookup of its numeric id, shared by concurrent checks
+        self.channel_ids: dict[str, asyncio.Task[Chat]] = {}
+
+    async def __call__(self, event: Message | CallbackQuery, settings: dict[int, BotSettings]) -> bool:
+        channels = settings[event.bot.id].channels
+        if await self.check(event.bot, event.from_user.id, channels):
+            return True
+
+        if isinstance(event, CallbackQuery):
+            await event.answer()
+        message = event if isinstance(event, Message) else event.message
+        await message.answer(
+            'Для пользования ботом нужно быть подписанным на каналы:',
+            reply_markup=pubs_inline_keyboard(channels)
+        )
+        return False
+
+    async def check(self, bot: Bot, user_id: int, channels: list[dict]) -> bool:
+        # membership does not depend on the bot, so mirrors share the cache
+        statuses = await asyncio.gather(*[
+            self.is_member(bot, user_id, channel['chat_id'])
+            for channel in channels
+        ])
+        return all(statuses)
+
+    async def is_member(self, bot: Bot, user_id: int, chat_id: int | str) -> bool:
+        channel_id = await self.channel_id(bot, chat_id)
+        is_member = self.cache.get((user_id, channel_id))
+        if is_member is None:
+            user_channel_status = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+            is_member = self._is_member_status(user_channel_status)
+            self.set_member(user_id, channel_id, is_member)
+        return is_member
+
+    async def channel_id(self, bot: Bot, chat_id: int | str) -> int:
+        if isinstance(chat_id, int) or chat_id.lstrip('-').isdigit():
+            return int(chat_id)
+        # usernames are case-insensitive, every channel is resolved once
+        username = chat_id.lower()
+        task = self.channel_ids.get(username)
+        if task is None:
+            task = self.channel_ids[username] = asyncio.create_task(bot.get_chat(chat_id))
+        try:
+            return (await asyncio.shield(task)).id
+        except Exception:
+            # a failed lookup is retried by the next check
+            if self.channel_ids.get(username) is task and task.done():
+                del self.channel_ids[username]
+            raise
+
+    def set_member(self, user_id: int, channel_id: int, is_member: bool):
+        ttl = self.member_ttl if is_member else self.not_member_ttl
+        self.cache.set((user_id, channel_id), is_member, ttl)
+
+    def update_member(self, event: ChatMemberUpdated):
+        is_member = self._is_member_status(event.new_chat_member)
+        self.set_member(event.new_chat_member.user.id, event.chat.id, is_member)
+
+    def forget_channel(self, event: ChatMemberUpdated):
+        # without admin rights the bot stops receiving chat_member updates for this channel
+        for key in self.cache.keys():
+            if key[1] == event.chat.id:
+                self.cache.pop(key)
+
+    @staticmethod
+    def _is_member_status(status: ChatMember) -> bool:
+        return isinstance(status, (ChatMemberMember, ChatMemberAdministrator, ChatMemberOwner))
@@ -0,0 +1,90 @@
+import asyncio
+import random
+from logging import Logger
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from lib.bot.scheduler import Lane, lane
+
+
+class LogForwarder:
+    message_limit = 4096
+    flush_interval = 5
+
+    def __init__(self, logger: Logger, chat_id: int, maxsize: int = 10_000, sample_rate: float = 0.1):
+        self.logger = logger
+        self.chat_id = chat_id
+        self.sample_rate = sample_rate
+
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize)
+        self.stats = {'queued': 0, 'forwarded': 0, 'chunks': 0, 'dropped': 0, 'sampled_out': 0, 'errors': 0}
+
+        self._task: asyncio.Task | None = None
+        self._chunk = ''
+
+    def start(self, bot: Bot):
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self, bot: Bot):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        while not self.queue.empty():
+            await self._append(bot, self.queue.get_nowait())
+        await self._send(bot)
+
+    def put(self, text: str):
+        # once the queue is half full only a sample of the messages is kept
+        if self.queue.qsize() >= self.queue.maxsize // 2 and random.random() >= self.sample_rate:
+            self.stats['sampled_out'] += 1
+            return
+        try:
+            self.queue.put_nowait(text[:self.message_limit - 1])
+            self.stats['queued'] += 1
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+
+    async def _run(self, bot: Bot):
+        loop = asyncio.get_running_loop()
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                text = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                await self._send(bot)
+                deadline = None
+                continue
+
+            if await self._append(bot, text) or deadline is None:
+                deadline = loop.time() + self.flush_interval
+
+    async def _append(self, bot: Bot, text: str) -> bool:
+        flushed = len(self._chunk) + len(text) + 1 > self.message_limit
+        if flushed:
+            await self._send(bot)
+        self._chunk += f'{text}\n'
+        self.stats['forwarded'] += 1
+        return flushed
+
+    async def _send(self, bot: Bot):
+        if not self._chunk:
+            return
+        chunk, self._chunk = self._chunk, ''
+
+        lane.set(Lane.LOG)
+        while True:
+            try:
+                await bot.send_message(self.chat_id, chunk, parse_mode=None)
+                self.stats['chunks'] += 1
+                return
+            except TelegramRetryAfter as ex:
+                self.logger.warning('Log chat flood control', extra={'retry_after': ex.retry_after})
+                await asyncio.sleep(ex.retry_after)
+            except Exception as ex:
+                self.stats['errors'] += 1
+                self.logger.error('Error forward messages', extra={'ex': ex})
+                return
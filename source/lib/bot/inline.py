@@ -0,0 +1,79 @@
+import asyncio
+
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+
+from lib.cache import TTLCache
+from lib.catalog import FilmCatalog
+
+
+class Debouncer:
+    def __init__(self, delay: float = 0.3):
+        self.delay = delay
+        self.latest: dict[int, str] = {}
+
+    async def wait(self, user_id: int, query_id: str) -> bool:
+        # only the last query typed within the delay is answered
+        self.latest[user_id] = query_id
+        await asyncio.sleep(self.delay)
+        if self.latest.get(user_id) != query_id:
+            return False
+        del self.latest[user_id]
+        return True
+
+
+class InlineResults:
+    limit = 10
+    ttl = 300
+
+    def __init__(self, catalog: FilmCatalog):
+        self.catalog = catalog
+        self.version = catalog.version
+        self.articles: dict[int, InlineQueryResultArticle] = {}
+        self.queries = TTLCache(maxsize=10_000)
+
+    async def get(self, query: str) -> tuple[list[InlineQueryResultArticle], bool]:
+        # the results and whether they are complete; before the first load the catalog is empty, so a code
+        # is looked up like a message, in the snapshot or in postgres, and nothing is cached
+        if not self.catalog.ready.is_set():
+            return await self.lookup(query.strip()), False
+
+        if self.version != self.catalog.version:
+            self.version = self.catalog.version
+            self.articles.clear()
+            self.queries.clear()
+
+        query = query.strip().lower()
+        results = self.queries.get(query)
+        if results is None:
+            if query.isdigit() and len(query) < 5:
+                codes = [int(query)] if int(query) in self.catalog.films else []
+            else:
+                codes = [code for code, _ in self.catalog.search(query, self.limit)]
+            results = [self.article(code) for code in codes]
+            self.queries.set(query, results, self.ttl)
+        return results, True
+
+    async def lookup(self, query: str) -> list[InlineQueryResultArticle]:
+        if not query.isdigit() or len(query) >= 5:
+            return []
+        code = int(query)
+        text = await self.catalog.get(code)
+        if text is None:
+            return []
+        return [InlineQueryResultArticle(
+            id=str(code),
+            title=str(code),
+            description=text.split('\n', 1)[0],
+            input_message_content=InputTextMessageContent(message_text=text)
+        )]
+
+    def article(self, code: int) -> InlineQueryResultArticle:
+        article = self.articles.get(code)
+        if article is None:
+            article = InlineQueryResultArticle(
+                id=str(code),
+                title=f'{code} - {self.catalog.titles[code]}',
+                input_message_content=InputTextMessageContent(message_text=self.catalog.films[code])
+            )
+            self.articles[code] = article
+        return article
@@ -2,11 +2,22 @@ from aiogram.filters.callback_data import CallbackData
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from lib.catalog import FilmsPage
+
 
 class AnswerCallback(CallbackData, prefix='admin'):
     answer: str
 
 
+class FilmCallback(CallbackData, prefix='film'):
+    code: int
+
+
+class PageCallback(CallbackData, prefix='page'):
+    direction: str
+    code: int
+
+
 yes_no_keyboard = ReplyKeyboardMarkup(
     keyboard=[
         [
@@ -43,3 +54,23 @@ def cancel_keyboard() -> InlineKeyboardMarkup:
     builder = InlineKeyboardBuilder()
     builder.button(text='Отмена', callback_data=AnswerCallback(answer='cancel').pack())
     return builder.as_markup()
+
+
+def pages_keyboard(page: FilmsPage) -> InlineKeyboardMarkup | None:
+    builder = InlineKeyboardBuilder()
+    if page.has_prev:
+        builder.button(text='<<', callback_data=PageCallback(direction='prev', code=page.first))
+    if page.has_next:
+        builder.button(text='>>', callback_data=PageCallback(direction='next', code=page.last))
+
+    return builder.as_markup() if page.has_prev or page.has_next else None
+
+
+def films_keyboard(films: list[tuple[int, str]]) -> InlineKeyboardMarkup:
+    builder = InlineKeyboardBuilder()
+    for code, title in films:
+        builder.button(text=f'{code} - {title}', callback_data=FilmCallback(code=code))
+
+    builder.adjust(1)
+
+    return builder.as_markup()
@@ -0,0 +1,126 @@
+import asyncio
+from logging import Logger
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputFile, Message, URLInputFile
+
+from lib.cache import TTLCache
+from lib.catalog import FilmMedia
+from lib.postgres import Postgres
+
+
+class MediaSender:
+    caption_limit = 1024
+    file_ttl = 86400
+    filenames = {'photo': 'poster.jpg', 'video': 'trailer.mp4'}
+
+    def __init__(self, postgres: Postgres, logger: Logger, bots: list[Bot]):
+        self.postgres = postgres
+        self.logger = logger
+        self.bots = {bot.id: bot for bot in bots}
+        self.main_bot_id = bots[0].id
+
+        # file_ids are per bot, the film keeps the one of its owner bot and the other bots keep their copies here
+        self.files = TTLCache()
+        # (bot id, code) -> file_id of an upload in progress, None when it failed
+        self.uploads: dict[tuple[int, int], asyncio.Future[str | None]] = {}
+        self.stats = {'cached': 0, 'uploaded': 0, 'stale': 0, 'failed': 0}
+
+    async def answer(self, message: Message, code: int, text: str):
+        media = self.postgres.catalog.media.get(code)
+        if media is None:
+            await message.answer(text)
+            return
+
+        caption = text if len(text) <= self.caption_limit else None
+        try:
+            sent = await self._send(message, code, media, caption)
+        except Exception as ex:
+            self.stats['failed'] += 1
+            self.logger.error('Error send film media', extra={'code': code, 'ex': ex})
+            sent = False
+        if not sent or caption is None:
+            await message.answer(text)
+
+    async def _send(self, message: Message, code: int, media: FilmMedia, caption: str | None) -> bool:
+        bot = message.bot
+        owner = (media.bot_id or self.main_bot_id) == bot.id
+        source = media.url or media.file_id
+        file_id = media.file_id if owner else await self._copy_file_id(bot.id, code, source)
+        if file_id is not None:
+            try:
+                await self._send_file(message, media.type, file_id, caption)
+                self.stats['cached'] += 1
+                return True
+            except TelegramBadRequest as ex:
+                if owner and media.url is None:
+                    raise
+                self.stats['stale'] += 1
+                self.logger.warning('Stale media file_id', extra={'code': code, 'bot_id': bot.id, 'ex': ex})
+
+        key = (bot.id, code)
+        upload = self.uploads.get(key)
+        if upload is not None:
+            # the same code requested during an upload waits for its file_id
+            file_id = await upload
+            if file_id is None:
+                return False
+            await self._send_file(message, media.type, file_id, caption)
+            self.stats['cached'] += 1
+            return True
+
+        upload = asyncio.get_running_loop().create_future()
+        self.uploads[key] = upload
+        file_id = None
+        try:
+            file = await self._source_file(media, owner)
+            if file is None:
+                return False
+            sent = await self._send_file(message, media.type, file, caption)
+            file_id = sent.photo[-1].file_id if media.type == 'photo' else sent.video.file_id
+        finally:
+            upload.set_result(file_id)
+            del self.uploads[key]
+
+        self.stats['uploaded'] += 1
+        try:
+            if owner or media.file_id is None:
+                # the first bot to upload from the url becomes the owner
+                self.postgres.catalog.set_file_id(code, file_id, bot.id)
+                await self.postgres.set_media_file_id(code, file_id, bot.id)
+            else:
+                self.files.set(key, (source, file_id), self.file_ttl)
+                await self.postgres.set_film_file(code, bot.id, source, file_id)
+        except Exception as ex:
+            self.logger.error('Error save media file_id', extra={'code': code, 'ex': ex})
+        return True
+
+    async def _copy_file_id(self, bot_id: int, code: int, source: str) -> str | None:
+        item = self.files.get((bot_id, code))
+        if item is not None and item[0] == source:
+            return item[1]
+
+        file_id = await self.postgres.get_film_file(code, bot_id, source)
+        if file_id is not None:
+            self.files.set((bot_id, code), (source, file_id), self.file_ttl)
+        return file_id
+
+    async def _source_file(self, media: FilmMedia, owner: bool) -> InputFile | None:
+        if media.url is not None:
+            return URLInputFile(media.url)
+        if owner:
+            return None
+
+        # a file sent to the owner bot is downloaded by it and uploaded by the mirror
+        owner_bot = self.bots.get(media.bot_id or self.main_bot_id)
+        if owner_bot is None:
+            return None
+        data = await owner_bot.download(media.file_id)
+        return BufferedInputFile(data.read(), self.filenames[media.type])
+
+    @staticmethod
+    async def _send_file(message: Message, media_type: str, file: str | InputFile, caption: str | None) -> Message:
+        if media_type == 'video':
+            return await message.answer_video(file, caption=caption)
+        return await message.answer_photo(file, caption=caption)
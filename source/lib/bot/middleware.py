@@ -1,14 +1,21 @@
+import time
 from logging import Logger
 from typing import Callable, Any, Awaitable
 
-from aiogram import BaseMiddleware
-from aiogram.types import Message
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import Message, TelegramObject, Update
+
+from lib.bot.forwarder import LogForwarder
+from lib.metrics import API_ERRORS, API_LATENCY, HANDLER_LATENCY, UPDATE_LATENCY
 
 
 class LogMessageMiddleware(BaseMiddleware):
-    def __init__(self, logger: Logger) -> None:
+    def __init__(self, logger: Logger, forwarders: dict[int, LogForwarder]) -> None:
         self.logger = logger
-        self.chat_id = -1002050723063
+        self.forwarders = forwarders
 
     async def __call__(
             self,
@@ -16,17 +23,62 @@ class LogMessageMiddleware(BaseMiddleware):
             event: Message,
             data: dict[str, Any]
     ) -> Any:
-        self.logger.info(event.text, extra={
+        self.logger.info('Message', extra={
             'username': event.from_user.username,
-            'user_id': event.from_user.id
+            'user_id': event.from_user.id,
+            'text': event.text
         })
-        try:
-            if event.chat.id != self.chat_id:
-                await event.bot.send_message(self.chat_id, f"{event.from_user.first_name}: {event.text}")
-        except:
-            self.logger.error('Error forward message', extra={
-                "type_event": type(event),
-                "event": str(event)
-            })
+        # every bot forwards to its own log chat
+        forwarder = self.forwarders.get(data['bot'].id)
+        if forwarder is not None and event.chat.id != forwarder.chat_id:
+            forwarder.put(f"{event.from_user.first_name}: {event.text}")
 
         return await handler(event, data)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: dict[str, Any]
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_LATENCY.labels(event.event_type).observe(time.perf_counter() - start)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: dict[str, Any]
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.labels(
+                data['event_router'].name,
+                data['handler'].callback.__name__
+            ).observe(time.perf_counter() - start)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as ex:
+            API_ERRORS.labels(method.__api_method__, type(ex).__name__).inc()
+            raise
+        finally:
+            API_LATENCY.labels(method.__api_method__).observe(time.perf_counter() - start)
@@ -0,0 +1,176 @@
+import asyncio
+import bisect
+import itertools
+import time
+from contextvars import ContextVar
+from enum import IntEnum
+from logging import Logger
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+from lib.cache import TTLCache
+
+
+class Lane(IntEnum):
+    REPLY = 0
+    LOG = 1
+    BROADCAST = 2
+
+
+lane: ContextVar[Lane] = ContextVar('lane', default=Lane.REPLY)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        # a bucket created after now was taken has nothing to refill
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class SendScheduler(BaseRequestMiddleware):
+    private_rate = 1
+    group_rate = 20 / 60
+    max_retries = 3
+
+    def __init__(self, logger: Logger, global_rate: float = 30):
+        self.logger = logger
+        # telegram limits every bot separately, mirrors sharing the session do not slow each other down
+        self.global_rate = global_rate
+        self.global_buckets: dict[int, TokenBucket] = {}
+        self.chat_buckets = TTLCache()
+
+        self.stats = {'sent': 0, 'retries': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+        self.lane_sent = {item.name.lower(): 0 for item in Lane}
+
+        self._waiters: list[tuple[int, int, int, int | str | None, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType]
+    ) -> Response[TelegramType]:
+        if not self._is_send(method):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(bot.id, chat_id, lane.get())
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as ex:
+                if attempt == self.max_retries:
+                    raise
+                self.stats['retries'] += 1
+                self.logger.warning('Flood control, retry', extra={
+                    'chat_id': chat_id,
+                    'retry_after': ex.retry_after
+                })
+                bucket = self._global_bucket(bot.id) if chat_id is None else self._chat_bucket(bot.id, chat_id)
+                bucket.pause(ex.retry_after)
+
+    async def acquire(self, bot_id: int, chat_id: int | str | None, priority: Lane = Lane.REPLY):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+        start = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        bisect.insort(self._waiters, (priority, next(self._seq), bot_id, chat_id, future))
+        self._wakeup.set()
+        await future
+
+        wait = time.monotonic() - start
+        self.stats['sent'] += 1
+        self.stats['wait_total'] += wait
+        self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+        self.lane_sent[priority.name.lower()] += 1
+
+    async def _run(self):
+        while True:
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            # the first waiter, in priority order, whose bot and chat are not rate limited
+            delay = None
+            for index, (_, _, bot_id, chat_id, future) in enumerate(self._waiters):
+                if future.done():
+                    del self._waiters[index]
+                    delay = 0
+                    break
+
+                global_bucket = self._global_bucket(bot_id)
+                bucket = None if chat_id is None else self._chat_bucket(bot_id, chat_id)
+                wait = max(global_bucket.delay(now), 0 if bucket is None else bucket.delay(now))
+                if wait == 0:
+                    del self._waiters[index]
+                    global_bucket.take()
+                    if bucket is not None:
+                        bucket.take()
+                    future.set_result(None)
+                    delay = 0
+                    break
+                delay = wait if delay is None else min(delay, wait)
+
+            if delay:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def _global_bucket(self, bot_id: int) -> TokenBucket:
+        bucket = self.global_buckets.get(bot_id)
+        if bucket is None:
+            bucket = self.global_buckets[bot_id] = TokenBucket(self.global_rate, self.global_rate)
+        return bucket
+
+    def _chat_bucket(self, bot_id: int, chat_id: int | str) -> TokenBucket:
+        bucket = self.chat_buckets.get((bot_id, chat_id))
+        if bucket is None:
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.private_rate if private else self.group_rate, 1)
+        # an idle bucket refills completely within a minute, so it is safe to forget it
+        self.chat_buckets.set((bot_id, chat_id), bucket, 60 / bucket.rate)
+        return bucket
+
+    @staticmethod
+    def _is_send(method: TelegramMethod) -> bool:
+        name = method.__api_method__
+        return (
+            name.startswith(('send', 'edit', 'copyMessage', 'forwardMessage'))
+            and name != 'sendChatAction'
+        )
@@ -0,0 +1,43 @@
+import json
+from typing import NamedTuple
+
+CHANNELS = [
+    {
+        "name": "Фильмы | Сериалы | Мультфильмы",
+        "url": "https://t.me/movienightee",
+        "chat_id": "@movienightee"
+    },
+    {
+        "name": "ВБ МАНИЯ",
+        "url": "https://t.me/WildBMania",
+        "chat_id": "@WildBMania"
+    }
+]
+LOG_CHAT_ID = -1002050723063
+
+
+class BotSettings(NamedTuple):
+    channels: list[dict]
+    log_chat_id: int | None
+
+
+def load_bot_settings(tokens: list[str], path: str | None = None) -> dict[int, BotSettings]:
+    # {"<bot id>": {"channels": [{"name": ..., "url": ..., "chat_id": ...}], "log_chat_id": ...}},
+    # a bot missing from the file gets the channels and the log chat of the main bot
+    config = {}
+    if path:
+        with open(path, encoding='utf-8') as file:
+            config = json.load(file)
+
+    settings = {}
+    main = BotSettings(CHANNELS, LOG_CHAT_ID)
+    for token in tokens:
+        bot_id = int(token.split(':')[0])
+        item = config.get(str(bot_id), {})
+        settings[bot_id] = BotSettings(
+            channels=item.get('channels', main.channels),
+            log_chat_id=item.get('log_chat_id', main.log_chat_id)
+        )
+        if len(settings) == 1:
+            main = settings[bot_id]
+    return settings
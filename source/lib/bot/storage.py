@@ -0,0 +1,146 @@
+import asyncio
+import json
+from logging import Logger
+from typing import Any, Dict, Optional
+
+import asyncpg
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from lib.cache import TTLCache
+from lib.models import FsmStates
+from lib.postgres import Postgres
+
+
+class PostgresStorage(BaseStorage):
+    cleanup_interval = 60
+    reconnect_delay = 5
+
+    def __init__(self, postgres: Postgres, logger: Logger, ttl: int = 86400, cache: bool = False):
+        self.postgres = postgres
+        self.logger = logger
+        self.ttl = ttl
+        # only safe when all updates of one user reach the same process
+        self.cache = TTLCache() if cache else None
+        self.active = 0
+
+        # keys with a state or data in any process, the state of everyone else is empty without asking postgres
+        self.live: set[tuple[int, int, int, str]] = set()
+        self.ready = False
+
+        self._loading: list[tuple[tuple, bool]] | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._cleanup_loop()), asyncio.create_task(self._listen())]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        self._mark(key, await self.postgres.set_fsm(self._key(key), state=state))
+        if self.cache is not None:
+            _, data = self.cache.get(key, (None, {}))
+            self.cache.set(key, (state, data), self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._mark(key, await self.postgres.set_fsm(self._key(key), data=data))
+        if self.cache is not None:
+            state, _ = self.cache.get(key, (None, {}))
+            self.cache.set(key, (state, data.copy()), self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        return data.copy()
+
+    async def _get(self, key: StorageKey) -> tuple[str | None, dict]:
+        # the fsm middleware asks for every update, only admins in the wizard are read from postgres
+        if self.ready and tuple(self._key(key).values()) not in self.live:
+            return None, {}
+        if self.cache is not None:
+            item = self.cache.get(key)
+            if item is not None:
+                return item
+
+        row = await self.postgres.get_fsm(self._key(key))
+        state, data = (None, None) if row is None else row
+        item = (state, data or {})
+        if self.cache is not None:
+            self.cache.set(key, item, self.ttl)
+        return item
+
+    def _mark(self, key: StorageKey, live: bool):
+        # the notification of the write comes later, the next update of the user must not wait for it
+        item = tuple(self._key(key).values())
+        if live:
+            self.live.add(item)
+        else:
+            self.live.discard(item)
+
+    @staticmethod
+    def _key(key: StorageKey) -> dict:
+        return dict(bot_id=key.bot_id, chat_id=key.chat_id, user_id=key.user_id, destiny=key.destiny)
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                deleted = await self.postgres.delete_expired_fsm(self.ttl)
+                if deleted:
+                    self.logger.info('Expired fsm states deleted', extra={'deleted': deleted})
+                self.active = await self.postgres.count_fsm()
+            except Exception as ex:
+                self.logger.error('Error delete expired fsm states', extra={'ex': ex})
+
+    def _on_notify(self, connection, pid, channel, payload):
+        *item, live = json.loads(payload)
+        if self._loading is not None:
+            self._loading.append((tuple(item), live))
+        elif live:
+            self.live.add(tuple(item))
+        else:
+            self.live.discard(tuple(item))
+
+    async def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.postgres.dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _: closed.set())
+                await conn.add_listener(FsmStates.channel, self._on_notify)
+                # subscribe before loading so that no write between them is lost, the writes notified
+                # during the load are applied over it in commit order
+                self._loading = []
+                live = set(await self.postgres.get_fsm_keys())
+                for item, is_live in self._loading:
+                    if is_live:
+                        live.add(item)
+                    else:
+                        live.discard(item)
+                self.live, self._loading = live, None
+                self.ready = True
+                self.logger.info('Fsm keys loaded', extra={'keys': len(self.live)})
+                await closed.wait()
+                self.logger.warning('Fsm listener disconnected')
+            except asyncio.CancelledError:
+                if conn is not None:
+                    await conn.close()
+                raise
+            except Exception as ex:
+                self.logger.error('Fsm listener error', extra={'ex': ex})
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+
+            # notifications are lost until the next load, every state is read from postgres meanwhile
+            self.ready = False
+            self._loading = None
+            await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,90 @@
+import time
+from logging import Logger
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from lib.cache import TTLCache
+from lib.registry import AdminCache
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    # runs on the update before the scheduler and the fsm, other updates are never dropped
+    throttled = ('message', 'callback_query')
+    duplicate_window = 2
+    # consecutive dropped updates before a ban
+    max_strikes = 20
+
+    def __init__(
+            self,
+            logger: Logger,
+            rate: float = 1,
+            burst: int = 5,
+            ban_time: float = 600,
+            maxsize: int = 100_000
+    ):
+        self.logger = logger
+        self.rate = rate
+        self.burst = burst
+        self.ban_time = ban_time
+
+        # (tokens, updated, last text hash, last text time, strikes), a user idle for longer
+        # than the ttl is back to a full bucket, so eviction loses nothing
+        self.users = TTLCache(maxsize)
+        self.ttl = max(burst / rate, self.duplicate_window)
+        self.banned = TTLCache(maxsize)
+
+        self.stats = {'throttled': 0, 'duplicates': 0, 'banned': 0, 'bans': 0}
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        admins: AdminCache = data['admins']
+        if event.event_type not in self.throttled or user is None or user.id in admins.admins:
+            return await handler(event, data)
+
+        text = event.message.text if event.event_type == 'message' else event.callback_query.data
+        if self.allow(user.id, text):
+            return await handler(event, data)
+
+    def allow(self, user_id: int, text: str | None) -> bool:
+        if self.banned.get(user_id):
+            self.stats['banned'] += 1
+            return False
+
+        now = time.monotonic()
+        tokens, updated, last_text, last_time, strikes = self.users.get(user_id, (self.burst, now, None, 0.0, 0))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        text_hash = None if text is None else hash(text)
+
+        if text_hash is not None and text_hash == last_text and now - last_time < self.duplicate_window:
+            self.stats['duplicates'] += 1
+            allowed = False
+        elif tokens < 1:
+            self.stats['throttled'] += 1
+            allowed = False
+        else:
+            tokens -= 1
+            allowed = True
+
+        if allowed:
+            last_text, last_time, strikes = text_hash, now, 0
+        else:
+            strikes += 1
+            if strikes >= self.max_strikes:
+                self.ban(user_id)
+                return False
+
+        self.users.set(user_id, (tokens, now, last_text, last_time, strikes), self.ttl)
+        return allowed
+
+    def ban(self, user_id: int):
+        self.banned.set(user_id, True, self.ban_time)
+        self.users.pop(user_id)
+        self.stats['bans'] += 1
+        self.logger.warning('User banned for flood', extra={'user_id': user_id, 'ban_time': self.ban_time})
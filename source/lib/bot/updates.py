@@ -0,0 +1,109 @@
+import asyncio
+import contextlib
+import time
+from collections import deque
+from logging import Logger
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+Item = tuple[Callable[[Update, dict[str, Any]], Awaitable[Any]], Update, dict[str, Any], float]
+
+
+class UpdateScheduler(BaseMiddleware):
+    # other updates, e.g. chat_member, are never shed
+    sheddable = ('message', 'callback_query', 'inline_query')
+    # need no ordering and skip the per-user queues, an inline query waiting for the previous one
+    # would never be superseded in the debouncer; they hold no worker, only a slot
+    unordered = ('inline_query', 'chosen_inline_result', 'chat_member', 'my_chat_member')
+
+    def __init__(self, logger: Logger, workers: int = 16, max_in_flight: int = 100, max_age: float = 0):
+        self.logger = logger
+        self.max_age = max_age
+
+        self.workers = asyncio.Semaphore(workers)
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.queues: dict[Hashable, deque[Item]] = {}
+        self.in_flight = 0
+
+        self.stats = {'processed': 0, 'shed': 0, 'errors': 0}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def __call__(
+            self,
+            handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+            event: Update,
+            data: dict[str, Any]
+    ) -> Any:
+        # blocks polling and webhook requests until there is a free slot
+        await self.slots.acquire()
+        self.in_flight += 1
+
+        key = self._key(event, data)
+        item = (handler, event, data, time.monotonic())
+        queue = self.queues.get(key)
+        if queue is not None:
+            queue.append(item)
+            return
+
+        self.queues[key] = deque([item])
+        task = asyncio.create_task(self._run(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def close(self, timeout: float = 10):
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _key(self, event: Update, data: dict[str, Any]) -> Hashable:
+        if event.event_type in self.unordered:
+            return 'update', event.update_id
+
+        # updates of one user are handled in order, so fsm steps never overtake each other
+        bot_id = data['bot'].id
+        user = data.get('event_from_user')
+        if user is not None:
+            return bot_id, user.id
+        chat = data.get('event_chat')
+        if chat is not None:
+            return bot_id, chat.id
+        return 'update', event.update_id
+
+    def _stale(self, event: Update, received: float) -> bool:
+        if not self.max_age or event.event_type not in self.sheddable:
+            return False
+
+        age = time.monotonic() - received
+        if event.message is not None:
+            age = max(age, time.time() - event.message.date.timestamp())
+        return age > self.max_age
+
+    async def _run(self, key: Hashable):
+        queue = self.queues[key]
+        try:
+            while queue:
+                handler, event, data, received = queue[0]
+                try:
+                    if self._stale(event, received):
+                        self.stats['shed'] += 1
+                    else:
+                        unordered = event.event_type in self.unordered
+                        async with contextlib.nullcontext() if unordered else self.workers:
+                            await handler(event, data)
+                        self.stats['processed'] += 1
+                except Exception as ex:
+                    self.stats['errors'] += 1
+                    self.logger.error('Error process update', extra={
+                        'update_id': event.update_id,
+                        'ex': ex
+                    }, exc_info=ex)
+                finally:
+                    queue.popleft()
+                    self.in_flight -= 1
+                    self.slots.release()
+        finally:
+            del self.queues[key]
@@ -0,0 +1,24 @@
+import asyncio
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str | None, max_in_flight: int, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        # Telegram keeps the connection open until there is a free slot,
+        # so a burst of updates backs up on its side instead of in memory
+        await self.semaphore.acquire()
+
+        feed_update_task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(feed_update_task)
+        feed_update_task.add_done_callback(self._background_feed_update_tasks.discard)
+        feed_update_task.add_done_callback(lambda _: self.semaphore.release())
+        return web.json_response({}, dumps=bot.session.json_dumps)
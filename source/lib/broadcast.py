@@ -0,0 +1,107 @@
+import asyncio
+from contextlib import aclosing
+from logging import Logger
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from lib.bot.scheduler import Lane, lane
+from lib.models import Broadcasts
+from lib.postgres import BroadcastLocked, Postgres
+from lib.registry import UserRegistry
+
+
+class Broadcaster:
+    batch_size = 1000
+
+    def __init__(self, postgres: Postgres, registry: UserRegistry, logger: Logger, concurrency: int = 20):
+        self.postgres = postgres
+        self.registry = registry
+        self.logger = logger
+        self.concurrency = concurrency
+
+        self.running: dict[int, Broadcasts] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(self, bots: list[Bot]):
+        for broadcast in await self.postgres.get_unfinished_broadcasts():
+            # the first bot is the main one
+            bot = bots[0] if broadcast.bot_id is None else next((b for b in bots if b.id == broadcast.bot_id), None)
+            if bot is None:
+                self.logger.warning('Broadcast bot is not running here', extra={
+                    'broadcast_id': broadcast.id, 'bot_id': broadcast.bot_id
+                })
+                continue
+            self.logger.info('Resume broadcast', extra={'broadcast_id': broadcast.id})
+            self.run(bot, broadcast)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def create(self, bot: Bot, text: str) -> Broadcasts:
+        broadcast = await self.postgres.create_broadcast(text, bot.id)
+        self.run(bot, broadcast)
+        return broadcast
+
+    def run(self, bot: Bot, broadcast: Broadcasts):
+        task = asyncio.create_task(self._run(bot, broadcast))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, bot: Bot, broadcast: Broadcasts):
+        lane.set(Lane.BROADCAST)
+        self.running[broadcast.id] = broadcast
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # a mirror sends only to its own users and deactivates them only for itself
+        mirror_id = None if bot.id == self.registry.main_bot_id else bot.id
+        try:
+            batches = self.postgres.stream_active_user_ids(broadcast.id, broadcast.last_user_id,
+                                                           self.batch_size, mirror_id)
+            # the lock of the broadcast is released as soon as it stops, not when the generator is collected
+            async with aclosing(batches):
+                async for user_ids in batches:
+                    results = await asyncio.gather(*[
+                        self._send(bot, semaphore, user_id, broadcast.text) for user_id in user_ids
+                    ])
+                    blocked = [user_id for user_id, result in zip(user_ids, results) if result == 'blocked']
+                    if blocked:
+                        await self.postgres.deactivate_users(blocked, mirror_id)
+                        self.registry.forget(blocked, bot.id)
+
+                    broadcast.last_user_id = user_ids[-1]
+                    broadcast.sent += results.count('sent')
+                    broadcast.blocked += len(blocked)
+                    broadcast.failed += results.count('failed')
+                    await self.postgres.save_broadcast(broadcast)
+
+            broadcast.is_finished = True
+            await self.postgres.save_broadcast(broadcast)
+            self.logger.info('Broadcast finished', extra={
+                'broadcast_id': broadcast.id,
+                'sent': broadcast.sent,
+                'blocked': broadcast.blocked,
+                'failed': broadcast.failed
+            })
+        except BroadcastLocked:
+            self.logger.info('Broadcast is running in another process', extra={'broadcast_id': broadcast.id})
+        except Exception as ex:
+            self.logger.error('Broadcast error', extra={'broadcast_id': broadcast.id, 'ex': ex})
+        finally:
+            self.running.pop(broadcast.id, None)
+
+    async def _send(self, bot: Bot, semaphore: asyncio.Semaphore, user_id: int, text: str) -> str:
+        async with semaphore:
+            try:
+                await bot.send_message(user_id, text)
+                return 'sent'
+            except TelegramForbiddenError:
+                return 'blocked'
+            except TelegramBadRequest as ex:
+                if 'chat not found' in ex.message:
+                    return 'blocked'
+                return 'failed'
+            except Exception as ex:
+                self.logger.warning('Broadcast send error', extra={'user_id': user_id, 'ex': ex})
+                return 'failed'
@@ -0,0 +1,242 @@
+import asyncio
+from typing import TYPE_CHECKING, NamedTuple
+
+import asyncpg
+
+from lib.models import FilmRecord, Films
+from lib.search import TrigramIndex
+from lib.snapshot import CatalogSnapshot
+
+if TYPE_CHECKING:
+    from lib.postgres import Postgres
+
+
+class FilmMedia(NamedTuple):
+    type: str
+    url: str | None
+    file_id: str | None
+    bot_id: int | None
+
+
+class FilmsPage(NamedTuple):
+    text: str
+    first: int
+    last: int
+    has_prev: bool
+    has_next: bool
+
+
+class FilmCatalog:
+    channel = 'films'
+    reload = '*'
+    reconnect_delay = 5
+    # 25 titles of up to 150 characters fit into one message
+    page_size = 25
+    save_delay = 1
+
+    def __init__(self, postgres: 'Postgres', snapshot: CatalogSnapshot | None = None):
+        self.postgres = postgres
+        self.logger = postgres.logger
+        self.snapshot = snapshot
+
+        self.films: dict[int, str] = {}
+        self.titles: dict[int, str] = {}
+        self.media: dict[int, FilmMedia] = {}
+        self.index = TrigramIndex()
+        self.pages: dict[tuple[int | None, int | None], FilmsPage] = {}
+        self.version = 0
+        self.ready = asyncio.Event()
+
+        # loads and refreshes run one at a time in notification order, each reads the primary after the previous
+        # one finished, so a slow load never overwrites a newer refresh and refreshes of one code never swap
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._refresh_tasks: set[asyncio.Task] = set()
+        self._save_task: asyncio.Task | None = None
+
+    async def start(self, timeout: float = 10):
+        self._task = asyncio.create_task(self._listen())
+        if self.snapshot is not None and self.snapshot.open():
+            self.logger.info('Catalog snapshot opened', extra={
+                'films': self.snapshot.count, 'age': round(self.snapshot.age)
+            })
+            return
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning('Film catalog is not loaded yet, lookups go to postgres')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+            await asyncio.gather(self._save_task, return_exceptions=True)
+            await self._save()
+        self.ready.clear()
+        if self.snapshot is not None:
+            self.snapshot.close()
+
+    async def get(self, code: int) -> str | None:
+        if self.ready.is_set():
+            return self.films.get(code)
+        # before the first load and while postgres is unreachable
+        if self.snapshot is not None and self.snapshot.available:
+            return self.snapshot.get(code)
+
+        film = await self.postgres.get_film_record(code)
+        return film.render() if film else None
+
+    def search(self, query: str, limit: int = 5) -> list[tuple[int, str]]:
+        return [(code, self.titles[code]) for code, _ in self.index.search(query, limit)]
+
+    async def get_page(self, after: int | None = None, before: int | None = None) -> FilmsPage | None:
+        key = (after, before)
+        page = self.pages.get(key)
+        if page is not None:
+            return page
+
+        version = self.version
+        try:
+            films = await self.postgres.get_films_page(self.page_size + 1, after=after, before=before)
+        except Exception as ex:
+            if self.snapshot is None or not self.snapshot.available:
+                raise
+            self.logger.warning('Films page from catalog snapshot', extra={'ex': ex})
+            films = self.snapshot.page(self.page_size + 1, after=after, before=before)
+            version = None
+        if not films:
+            return None
+
+        has_more = len(films) > self.page_size
+        if before is None:
+            films = films[:self.page_size]
+        else:
+            films = films[-self.page_size:]
+
+        page = FilmsPage(
+            text='\n'.join([f'{code} - {title}' for code, title in films]),
+            first=films[0][0],
+            last=films[-1][0],
+            has_prev=has_more if before is not None else after is not None,
+            has_next=has_more if before is None else True
+        )
+        if self.ready.is_set() and version == self.version:
+            self.pages[key] = page
+        return page
+
+    def put(self, film: Films):
+        self._invalidate()
+        if self.ready.is_set():
+            self._set(film)
+
+    def drop(self, code: int):
+        self._invalidate()
+        if self.ready.is_set():
+            self._remove(code)
+
+    def set_file_id(self, code: int, file_id: str, bot_id: int):
+        media = self.media.get(code)
+        if media is not None:
+            self.media[code] = media._replace(file_id=file_id, bot_id=bot_id)
+
+    async def load(self):
+        async with self._lock:
+            # a notification means the primary has the change, a replica may not have it yet
+            films = await self.postgres.get_all_films(primary=True)
+            index = TrigramIndex()
+            for film in films:
+                index.add(film.code, film.title)
+
+            self.films = {film.code: film.render() for film in films}
+            self.titles = {film.code: film.title for film in films}
+            self.media = {
+                film.code: FilmMedia(film.media_type, film.media_url, film.media_file_id, film.media_bot_id)
+                for film in films if film.media_type
+            }
+            self.index = index
+            self._invalidate()
+            self.ready.set()
+            self._schedule_save()
+        self.logger.info('Film catalog loaded', extra={'films': len(self.films)})
+
+    async def refresh(self, code: int):
+        self._invalidate()
+        async with self._lock:
+            film = await self.postgres.get_film_record(code, primary=True)
+            if film is None:
+                self._remove(code)
+            else:
+                self._set(film)
+
+    def _set(self, film: Films | FilmRecord):
+        self.films[film.code] = film.render()
+        self.titles[film.code] = film.title
+        if film.media_type:
+            self.media[film.code] = FilmMedia(film.media_type, film.media_url, film.media_file_id, film.media_bot_id)
+        else:
+            self.media.pop(film.code, None)
+        self.index.add(film.code, film.title)
+        self._schedule_save()
+
+    def _remove(self, code: int):
+        self.films.pop(code, None)
+        self.titles.pop(code, None)
+        self.media.pop(code, None)
+        self.index.remove(code)
+        self._schedule_save()
+
+    def _schedule_save(self):
+        if self.snapshot is None or (self._save_task is not None and not self._save_task.done()):
+            return
+        self._save_task = asyncio.create_task(self._save(self.save_delay))
+
+    async def _save(self, delay: float = 0):
+        # a burst of changes is written once
+        await asyncio.sleep(delay)
+        if not self.ready.is_set():
+            return
+        try:
+            await asyncio.to_thread(CatalogSnapshot.write, self.snapshot.path, dict(self.films), dict(self.titles))
+            self.snapshot.open()
+        except Exception as ex:
+            self.logger.error('Error write catalog snapshot', extra={'ex': ex})
+
+    def _invalidate(self):
+        self.version += 1
+        self.pages.clear()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        if payload == self.reload:
+            task = asyncio.create_task(self.load())
+        else:
+            task = asyncio.create_task(self.refresh(int(payload)))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.postgres.dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _: closed.set())
+                await conn.add_listener(self.channel, self._on_notify)
+                # subscribe before loading so that no change between them is lost
+                await self.load()
+                await closed.wait()
+                self.logger.warning('Film catalog listener disconnected')
+            except asyncio.CancelledError:
+                if conn is not None:
+                    await conn.close()
+                raise
+            except Exception as ex:
+                self.logger.error('Film catalog listener error', extra={'ex': ex})
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+
+            self.ready.clear()
+            self._invalidate()
+            await asyncio.sleep(self.reconnect_delay)
@@ -0,0 +1,60 @@
+import csv
+import io
+import json
+
+FILM_COLUMNS = ['code', 'title', 'description', 'links_view', 'source_url']
+
+
+def parse_films(data: bytes, filename: str) -> tuple[list[tuple], list[str]]:
+    try:
+        if filename.lower().endswith('.json'):
+            items = json.loads(data)
+            if not isinstance(items, list):
+                return [], ['Ожидается список объектов']
+        else:
+            items = list(csv.DictReader(io.StringIO(data.decode('utf-8-sig'))))
+    except (ValueError, csv.Error) as ex:
+        return [], [f'Не удалось прочитать файл: {ex}']
+
+    rows, errors, codes = [], [], set()
+    # the header is the first line of a csv file
+    first_line = 1 if filename.lower().endswith('.json') else 2
+    for line, item in enumerate(items, first_line):
+        try:
+            row = validate_film(item)
+        except ValueError as ex:
+            errors.append(f'{line}: {ex}')
+            continue
+
+        if row[0] in codes:
+            errors.append(f'{line}: код {row[0]} повторяется')
+            continue
+        codes.add(row[0])
+        rows.append(row)
+
+    return rows, errors
+
+
+def validate_film(item) -> tuple:
+    if not isinstance(item, dict):
+        raise ValueError('ожидается объект')
+
+    # a json code of 0 is a valid code, only a missing one is empty
+    code = item.get('code')
+    code = '' if code is None else str(code).strip()
+    if not code.isdigit() or len(code) > 4:
+        raise ValueError(f'некорректный код {code!r}')
+
+    title = str(item.get('title') or '').strip()
+    if not title or len(title) > 150:
+        raise ValueError('название должно быть от 1 до 150 символов')
+
+    links_view = item.get('links_view') or []
+    if isinstance(links_view, str):
+        links_view = links_view.split()
+    if not isinstance(links_view, list) or not all(isinstance(link, str) for link in links_view):
+        raise ValueError('ссылки для просмотра должны быть строками')
+
+    description = item.get('description') or None
+    source_url = item.get('source_url') or None
+    return int(code), title, description and str(description), links_view or None, source_url and str(source_url)
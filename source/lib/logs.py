@@ -0,0 +1,43 @@
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, maxsize: int = 10_000):
+        super().__init__(queue.Queue(maxsize))
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # formatting happens in the listener thread, not on the event loop
+        return record
+
+
+class DrainingQueueListener(QueueListener):
+    def enqueue_sentinel(self):
+        # the queue can be full at shutdown, wait for the thread to drain it
+        self.queue.put(self._sentinel)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        rate = self.rates.get(record.msg)
+        if rate is None or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
@@ -0,0 +1,125 @@
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from lib.logs import DroppingQueueHandler, SamplingFilter
+
+UPDATE_LATENCY = Histogram('film_bot_update_seconds', 'Update processing time', ['type'])
+HANDLER_LATENCY = Histogram('film_bot_handler_seconds', 'Handler time', ['router', 'handler'])
+SQL_LATENCY = Histogram('film_bot_sql_seconds', 'SQL statement time', ['statement'])
+API_LATENCY = Histogram('film_bot_api_seconds', 'Bot API call time', ['method'])
+API_ERRORS = Counter('film_bot_api_errors_total', 'Bot API call errors', ['method', 'error'])
+
+
+def observe_sql(statement: str, elapsed: float):
+    # statements use bound parameters, so the start of the text identifies the query
+    SQL_LATENCY.labels(' '.join(statement.split())[:80]).observe(elapsed)
+
+
+@contextmanager
+def timed_sql(statement: str):
+    # for queries on the raw asyncpg connection, which the engine events do not see
+    start = time.perf_counter()
+    yield
+    observe_sql(statement, time.perf_counter() - start)
+
+
+def instrument_engine(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        observe_sql(statement, time.perf_counter() - conn.info['query_start'].pop())
+
+
+class ServiceCollector:
+    def __init__(self, service):
+        self.service = service
+
+    def collect(self):
+        service = self.service
+
+        pool = service.postgres.pool_stats()
+        for name in ('size', 'checked_in', 'checked_out', 'overflow'):
+            yield GaugeMetricFamily(f'film_bot_pool_{name}', f'Postgres pool {name}', value=pool[name])
+        yield CounterMetricFamily('film_bot_pool_checkouts', 'Postgres pool checkouts', value=pool['checkouts'])
+        yield CounterMetricFamily('film_bot_pool_timeouts', 'Postgres pool checkout timeouts', value=pool['timeouts'])
+        yield CounterMetricFamily(
+            'film_bot_pool_wait_seconds', 'Postgres pool checkout wait', value=pool['wait_avg'] * pool['checkouts']
+        )
+
+        if service.postgres.replicas:
+            healthy = GaugeMetricFamily('film_bot_replica_healthy', 'Replica receives reads', labels=['replica'])
+            lag = GaugeMetricFamily('film_bot_replica_lag_seconds', 'Replica replay lag', labels=['replica'])
+            for replica in service.postgres.replicas:
+                healthy.add_metric([replica.name], int(replica.healthy))
+                lag.add_metric([replica.name], replica.lag)
+            yield healthy
+            yield lag
+
+        scheduler = service.scheduler
+        yield GaugeMetricFamily('film_bot_send_queue', 'Messages waiting for a send slot', value=scheduler.queue_depth)
+        yield CounterMetricFamily('film_bot_send_wait_seconds', 'Send slot wait', value=scheduler.stats['wait_total'])
+        yield CounterMetricFamily('film_bot_send_retries', 'Sends retried after 429', value=scheduler.stats['retries'])
+        sent = CounterMetricFamily('film_bot_sent', 'Messages sent', labels=['lane'])
+        for lane, value in scheduler.lane_sent.items():
+            sent.add_metric([lane], value)
+        yield sent
+
+        updates = service.updates
+        yield GaugeMetricFamily('film_bot_updates_in_flight', 'Updates received and not yet handled', value=updates.in_flight)
+        handled = CounterMetricFamily('film_bot_updates', 'Updates taken by the update scheduler', labels=['result'])
+        for result, value in updates.stats.items():
+            handled.add_metric([result], value)
+        yield handled
+
+        log_queue = GaugeMetricFamily('film_bot_log_queue', 'Log chat queue', labels=['bot'])
+        forwarded = CounterMetricFamily('film_bot_log_messages', 'Log chat messages', labels=['bot', 'result'])
+        for bot_id, forwarder in service.forwarders.items():
+            log_queue.add_metric([str(bot_id)], forwarder.queue.qsize())
+            for result, value in forwarder.stats.items():
+                forwarded.add_metric([str(bot_id), result], value)
+        yield log_queue
+        yield forwarded
+
+        dropped = CounterMetricFamily('film_bot_log_records_dropped', 'Log records not written', labels=['reason'])
+        for item in (*service.logger.handlers, *service.logger.filters):
+            if isinstance(item, DroppingQueueHandler):
+                dropped.add_metric(['queue_full'], item.dropped)
+            elif isinstance(item, SamplingFilter):
+                dropped.add_metric(['sampled_out'], item.sampled_out)
+        yield dropped
+
+        throttled = CounterMetricFamily('film_bot_throttled_updates', 'Updates dropped by flood control', labels=['reason'])
+        for reason in ('throttled', 'duplicates', 'banned'):
+            throttled.add_metric([reason], service.throttling.stats[reason])
+        yield throttled
+        yield CounterMetricFamily('film_bot_bans', 'Users banned for flood', value=service.throttling.stats['bans'])
+
+        media = CounterMetricFamily('film_bot_media_sends', 'Film posters and trailers sent', labels=['result'])
+        for result, value in service.media.stats.items():
+            media.add_metric([result], value)
+        yield media
+
+        yield GaugeMetricFamily('film_bot_fsm_states', 'Active FSM states', value=service.storage.active)
+        yield GaugeMetricFamily('film_bot_pending_users', 'Users waiting for insert', value=service.registry.pending)
+        yield GaugeMetricFamily('film_bot_films', 'Films in the catalog', value=len(service.postgres.catalog.films))
+        snapshot = service.postgres.catalog.snapshot
+        if snapshot is not None and snapshot.available:
+            yield GaugeMetricFamily('film_bot_catalog_snapshot_age_seconds', 'Catalog snapshot age', value=snapshot.age)
+        yield GaugeMetricFamily('film_bot_broadcasts', 'Running broadcasts', value=len(service.broadcaster.running))
+
+
+def register_service(service):
+    REGISTRY.register(ServiceCollector(service))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(REGISTRY), headers={'Content-Type': CONTENT_TYPE_LATEST})
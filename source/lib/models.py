@@ -1,9 +1,10 @@
 from datetime import datetime
+from typing import NamedTuple
 
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import func
-from sqlalchemy.dialects.postgresql import SMALLINT, VARCHAR, ARRAY, BIGINT
+from sqlalchemy import func, true
+from sqlalchemy.dialects.postgresql import SMALLINT, VARCHAR, ARRAY, BIGINT, JSONB, INTEGER
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -24,6 +25,16 @@ class Users(Base):
     language_code: Mapped[str] = mapped_column(VARCHAR(5))
     is_premium: Mapped[bool] = mapped_column(nullable=True)
     is_admin: Mapped[bool] = mapped_column(default=False)
+    is_active: Mapped[bool] = mapped_column(default=True, server_default=true())
+
+
+class BotUsers(Base):
+    __tablename__ = "bot_users"
+
+    # users of the mirror bots, the users of the main bot are users.is_active
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    is_active: Mapped[bool] = mapped_column(default=True, server_default=true())
 
 
 class Films(Base):
@@ -34,6 +45,83 @@ class Films(Base):
     description: Mapped[str] = mapped_column(VARCHAR(), nullable=True)
     links_view: Mapped[list[str]] = mapped_column(ARRAY(VARCHAR()), nullable=True)
     source_url: Mapped[str] = mapped_column(nullable=True)
+    # photo or video, sent from the telegram file_id once it is known, uploaded from the url otherwise
+    media_type: Mapped[str] = mapped_column(VARCHAR(5), nullable=True)
+    media_url: Mapped[str] = mapped_column(nullable=True)
+    media_file_id: Mapped[str] = mapped_column(nullable=True)
+    # file_ids only work for the bot that received them, null means the main bot
+    media_bot_id: Mapped[int] = mapped_column(BIGINT, nullable=True)
 
     def __str__(self):
         return f"{self.code} - {self.title}"
+
+    def render(self) -> str:
+        text = f'Название: {self.title}\n'
+        if self.description:
+            text += f'Описание: {self.description}\n'
+        if self.links_view:
+            text += f'Ссылки для просмотра: {", ".join(self.links_view)}\n'
+        if self.source_url:
+            text += f'Ссылка shorts/reals: {self.source_url}\n'
+        return text
+
+
+class FilmRecord(NamedTuple):
+    code: int
+    title: str
+    description: str | None
+    links_view: list[str] | None
+    source_url: str | None
+    media_type: str | None
+    media_url: str | None
+    media_file_id: str | None
+    media_bot_id: int | None
+
+    render = Films.render
+
+
+class FilmFiles(Base):
+    __tablename__ = "film_files"
+
+    # file_ids of a film's media for the other bots, source is the url or file_id they were copied from
+    code: Mapped[int] = mapped_column(SMALLINT(), primary_key=True)
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    source: Mapped[str] = mapped_column()
+    file_id: Mapped[str] = mapped_column()
+
+
+class FsmStates(Base):
+    __tablename__ = "fsm_states"
+    # every write notifies the processes, so they know whose state to read without asking postgres
+    channel = 'fsm'
+
+    bot_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    chat_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BIGINT, primary_key=True)
+    destiny: Mapped[str] = mapped_column(VARCHAR(32), primary_key=True, default='default')
+    state: Mapped[str] = mapped_column(VARCHAR(255), nullable=True)
+    data: Mapped[dict] = mapped_column(JSONB, nullable=True)
+
+
+class Broadcasts(Base):
+    __tablename__ = "broadcasts"
+    lock_key = 1
+
+    id: Mapped[int] = mapped_column(INTEGER, primary_key=True, autoincrement=True)
+    text: Mapped[str] = mapped_column(VARCHAR(4096))
+    last_user_id: Mapped[int] = mapped_column(BIGINT, default=0)
+    sent: Mapped[int] = mapped_column(default=0)
+    blocked: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+    is_finished: Mapped[bool] = mapped_column(default=False)
+    # null for broadcasts started before mirrors, they are sent by the main bot
+    bot_id: Mapped[int] = mapped_column(BIGINT, nullable=True)
+
+
+class CodeStats(Base):
+    __tablename__ = "code_stats"
+
+    code: Mapped[int] = mapped_column(SMALLINT(), primary_key=True)
+    hour: Mapped[datetime] = mapped_column(primary_key=True)
+    hits: Mapped[int] = mapped_column(default=0)
+    misses: Mapped[int] = mapped_column(default=0)
@@ -1,28 +1,259 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import timedelta
 from logging import Logger
 
+import asyncpg
+
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.asyncio.engine import AsyncConnection
 from sqlalchemy import select
+from sqlalchemy import delete
+from sqlalchemy import update
+from sqlalchemy import text
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from lib.catalog import FilmCatalog
+from lib.films_io import FILM_COLUMNS
+from lib.metrics import timed_sql
+from lib.models import Base, Users, BotUsers, Films, FilmFiles, FilmRecord, FsmStates, Broadcasts, CodeStats
+from lib.snapshot import CatalogSnapshot
+
+
+# columns added to existing tables, create_all only creates missing tables; an ALTER waits for an exclusive lock
+# even when the column exists, so existing columns are skipped
+MIGRATIONS = [
+    (Users, 'is_active', 'BOOLEAN NOT NULL DEFAULT TRUE'),
+    (Films, 'media_type', 'VARCHAR(5)'),
+    (Films, 'media_url', 'VARCHAR'),
+    (Films, 'media_file_id', 'VARCHAR'),
+    (Films, 'media_bot_id', 'BIGINT'),
+    (Broadcasts, 'bot_id', 'BIGINT'),
+]
+COLUMNS_QUERY = text('SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = :schema')
+
+
+# hot reads skip the orm, asyncpg prepares each query once per pooled connection
+FILMS_QUERY = f'SELECT {", ".join(FilmRecord._fields)} FROM "{Films.__table__.schema}".{Films.__tablename__}'
+FILM_QUERY = f'{FILMS_QUERY} WHERE code = $1'
+USER_QUERY = f'SELECT user_id FROM "{Users.__table__.schema}".{Users.__tablename__} WHERE user_id = $1'
+ADMIN_QUERY = f'SELECT is_admin FROM "{Users.__table__.schema}".{Users.__tablename__} WHERE user_id = $1'
+
+
+class BroadcastLocked(Exception):
+    pass
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkouts, pool.wait_total, pool.wait_max, pool.timeouts = (
+            self.checkouts, self.wait_total, self.wait_max, self.timeouts
+        )
+        return pool
+
 
-from lib.models import Base, Users, Films
+class Replica:
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.name = engine.url.render_as_string(hide_password=True)
+        # nothing is read from a replica before its first check
+        self.healthy = False
+        self.lag = 0.0
 
 
 class Postgres:
-    def __init__(self, url, logger: Logger):
+    replica_check_interval = 5
+    replica_check_timeout = 2
+    # wal positions in bytes, the replica is compared with the primary and not with what it has received,
+    # so a replica whose wal receiver is disconnected still lags
+    primary_wal_query = text("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn")
+    replay_wal_query = text("SELECT pg_last_wal_replay_lsn() - '0/0'::pg_lsn")
+
+    def __init__(
+            self,
+            url,
+            logger: Logger,
+            pool_size: int = 10,
+            max_overflow: int = 5,
+            pool_timeout: float = 10,
+            pool_recycle: int = 1800,
+            pool_pre_ping: bool = False,
+            statement_timeout: int = 5000,
+            catalog_snapshot: str | None = None,
+            replica_urls: list[str] | None = None,
+            max_replica_lag: float = 5
+    ):
         self.url = url
         self.logger = logger
+        self.max_replica_lag = max_replica_lag
 
-        self.engine = create_async_engine(self.url, echo=False)
+        engine_args = dict(
+            echo=False,
+            poolclass=TimedQueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_recycle=pool_recycle,
+            pool_pre_ping=pool_pre_ping,
+            connect_args={
+                'command_timeout': statement_timeout / 1000 * 2 or None,
+                'server_settings': {'statement_timeout': str(statement_timeout)}
+            }
+        )
+        self.engine = create_async_engine(self.url, **engine_args)
+        self.replicas = [Replica(create_async_engine(replica_url, **engine_args)) for replica_url in replica_urls or []]
         self.async_session = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self._task: asyncio.Task | None = None
 
-    async def __scalar(self, statement, many=False):
-        async with self.async_session() as session:
-            if many:
-                return await session.scalars(statement)
-            return await session.scalar(statement)
+        self.catalog = FilmCatalog(self, CatalogSnapshot(catalog_snapshot, logger) if catalog_snapshot else None)
+
+    @property
+    def dsn(self) -> str:
+        return self.engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+    def pool_stats(self) -> dict:
+        pool: TimedQueuePool = self.engine.pool
+        return {
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'checkouts': pool.checkouts,
+            'wait_avg': pool.wait_total / pool.checkouts if pool.checkouts else 0.0,
+            'wait_max': pool.wait_max,
+            'timeouts': pool.timeouts
+        }
+
+    def start(self):
+        if self.replicas:
+            self._task = asyncio.create_task(self._check_replicas_loop())
+
+    @asynccontextmanager
+    async def driver_connection(self, engine: AsyncEngine | None = None):
+        async with (engine or self.engine).connect() as conn:
+            raw = await conn.get_raw_connection()
+            yield raw.driver_connection
+
+    async def __read(self, operation, primary: bool = False):
+        # operation(engine), reads that must see the latest writes pass primary=True
+        healthy = [] if primary else [replica for replica in self.replicas if replica.healthy]
+        if healthy:
+            replica = random.choice(healthy)
+            try:
+                return await operation(replica.engine)
+            except Exception as ex:
+                replica.healthy = False
+                self.logger.warning('Replica evicted', extra={'replica': replica.name, 'ex': ex})
+        return await operation(self.engine)
+
+    async def __fetch(self, query: str, *args, primary: bool = False):
+        async def fetch(engine: AsyncEngine):
+            async with self.driver_connection(engine) as conn:
+                with timed_sql(query):
+                    return await conn.fetch(query, *args)
+        return await self.__read(fetch, primary)
+
+    async def __fetchrow(self, query: str, *args, primary: bool = False):
+        async def fetchrow(engine: AsyncEngine):
+            async with self.driver_connection(engine) as conn:
+                with timed_sql(query):
+                    return await conn.fetchrow(query, *args)
+        return await self.__read(fetchrow, primary)
+
+    async def __fetchval(self, query: str, *args, primary: bool = False):
+        async def fetchval(engine: AsyncEngine):
+            async with self.driver_connection(engine) as conn:
+                with timed_sql(query):
+                    return await conn.fetchval(query, *args)
+        return await self.__read(fetchval, primary)
+
+    async def __scalar(self, statement, many=False, replica=False):
+        async def scalar(engine: AsyncEngine):
+            async with self.async_session(bind=engine) as session:
+                if many:
+                    return await session.scalars(statement)
+                return await session.scalar(statement)
+        return await self.__read(scalar, primary=not replica)
+
+    async def _wal_position(self, engine: AsyncEngine, query) -> int:
+        async with engine.connect() as conn:
+            # null on a server that is not a replica
+            return int(await asyncio.wait_for(conn.scalar(query), self.replica_check_timeout))
+
+    @staticmethod
+    def replica_lag(history: deque[tuple[float, int]], replayed: int, now: float) -> float:
+        # seconds since the primary was at the oldest position the replica has not replayed; the oldest entry
+        # is kept older than the max lag, a replica behind it lags too much or, right after start, is not trusted yet
+        for index, (checked, position) in enumerate(history):
+            if replayed < position:
+                return now - checked if index else float('inf')
+        return 0.0
+
+    async def _check_replica(self, replica: Replica, history: deque[tuple[float, int]]):
+        try:
+            replayed = await self._wal_position(replica.engine, self.replay_wal_query)
+            lag = self.replica_lag(history, replayed, time.monotonic())
+        except Exception as ex:
+            if replica.healthy:
+                self.logger.warning('Replica evicted', extra={'replica': replica.name, 'ex': ex})
+            replica.healthy = False
+            return
+
+        replica.lag = lag
+        healthy = lag <= self.max_replica_lag
+        if healthy != replica.healthy:
+            self.logger.warning(
+                'Replica restored' if healthy else 'Replica evicted',
+                extra={'replica': replica.name, 'lag': round(lag, 3)}
+            )
+        replica.healthy = healthy
+
+    async def _check_replicas_loop(self):
+        # (time, primary wal position) of the recent checks
+        history: deque[tuple[float, int]] = deque()
+        while True:
+            try:
+                position = await self._wal_position(self.engine, self.primary_wal_query)
+            except Exception as ex:
+                # without the primary position the replicas keep their state
+                self.logger.warning('Error check primary wal position', extra={'ex': ex})
+            else:
+                now = time.monotonic()
+                history.append((now, position))
+                while len(history) > 1 and now - history[1][0] >= self.max_replica_lag:
+                    history.popleft()
+                await asyncio.gather(*[self._check_replica(replica, history) for replica in self.replicas])
+            await asyncio.sleep(self.replica_check_interval)
 
     async def insert(self, model):
         async with self.async_session() as session:
@@ -35,16 +266,90 @@ class Postgres:
                 await session.delete(model)
 
     async def get_user(self, user_id: int):
-        stmt = select(Users.user_id).where(Users.user_id == user_id)
-        return await self.__scalar(stmt)
+        return await self.__fetchval(USER_QUERY, user_id)
+
+    async def get_user_ids(self) -> set[int]:
+        # inactive users are left out, so they are activated again on their next /start
+        stmt = select(Users.user_id).where(Users.is_active)
+        async with self.async_session() as session:
+            result = await session.stream_scalars(stmt.execution_options(yield_per=10_000))
+            return {user_id async for user_id in result}
+
+    async def get_bot_users(self) -> set[tuple[int, int]]:
+        stmt = select(BotUsers.bot_id, BotUsers.user_id).where(BotUsers.is_active)
+        async with self.async_session() as session:
+            result = await session.stream(stmt.execution_options(yield_per=10_000))
+            return {(bot_id, user_id) async for bot_id, user_id in result}
+
+    async def insert_users(self, users: list[dict]):
+        # users who blocked the main bot become active again once they come back to it,
+        # users who came to a mirror are inserted inactive and stay so
+        stmt = insert(Users).values(users)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Users.user_id],
+            set_={'is_active': True},
+            where=~Users.is_active & stmt.excluded.is_active
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
+
+    async def insert_bot_users(self, users: list[dict]):
+        stmt = insert(BotUsers).values(users).on_conflict_do_update(
+            index_elements=[BotUsers.bot_id, BotUsers.user_id],
+            set_={'is_active': True, 'date_update': func.now()},
+            where=~BotUsers.is_active
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
+
+    async def stream_active_user_ids(self, broadcast_id: int, after: int, batch_size: int, bot_id: int | None = None):
+        # bot_id of a mirror, the main bot sends to users
+        if bot_id is None:
+            column, stmt = Users.user_id, select(Users.user_id).where(Users.is_active)
+        else:
+            column, stmt = BotUsers.user_id, select(BotUsers.user_id).where(BotUsers.bot_id == bot_id, BotUsers.is_active)
+
+        # a session lock on a connection of its own, so only one replica runs a broadcast; no transaction stays
+        # open for the hours of a broadcast, every batch is read by a short query after the last sent user
+        conn = await asyncpg.connect(self.dsn)
+        try:
+            if not await conn.fetchval('SELECT pg_try_advisory_lock($1, $2)', Broadcasts.lock_key, broadcast_id):
+                raise BroadcastLocked(broadcast_id)
+
+            while True:
+                batch = stmt.where(column > after).order_by(column).limit(batch_size)
+                user_ids = (await self.__scalar(batch, many=True)).all()
+                if not user_ids:
+                    return
+                yield user_ids
+                after = user_ids[-1]
+        finally:
+            # releases the lock
+            await conn.close()
+
+    async def deactivate_users(self, user_ids: list[int], bot_id: int | None = None):
+        if bot_id is None:
+            stmt = update(Users).where(Users.user_id.in_(user_ids)).values(is_active=False)
+        else:
+            stmt = update(BotUsers).where(BotUsers.bot_id == bot_id, BotUsers.user_id.in_(user_ids)).values(
+                is_active=False
+            )
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
 
     async def get_count_users(self):
         stmt = select(func.count()).select_from(Users)
-        return await self.__scalar(stmt)
+        return await self.__scalar(stmt, replica=True)
 
     async def get_admin(self, user_id: int):
-        stmt = select(Users.is_admin).where(Users.user_id == user_id)
-        return await self.__scalar(stmt)
+        return await self.__fetchval(ADMIN_QUERY, user_id)
+
+    async def get_admin_ids(self) -> set[int]:
+        stmt = select(Users.user_id).where(Users.is_admin)
+        return set(await self.__scalar(stmt, many=True, replica=True))
 
     async def get_film(self, code: int, obj=False):
         if obj:
@@ -53,17 +358,260 @@ class Postgres:
             stmt = select(Films.title).where(Films.code == code)
         return await self.__scalar(stmt)
 
-    async def get_all_films(self) -> list[Films]:
-        stmt = select(Films)
-        return await self.__scalar(stmt, many=True)
+    async def get_film_record(self, code: int, primary: bool = False) -> FilmRecord | None:
+        row = await self.__fetchrow(FILM_QUERY, code, primary=primary)
+        return None if row is None else FilmRecord(*row)
+
+    async def get_all_films(self, primary: bool = False) -> list[FilmRecord]:
+        return [FilmRecord(*row) for row in await self.__fetch(FILMS_QUERY, primary=primary)]
+
+    async def get_films_page(self, limit: int, after: int | None = None, before: int | None = None) -> list:
+        stmt = select(Films.code, Films.title).limit(limit)
+        if before is not None:
+            stmt = stmt.where(Films.code < before).order_by(Films.code.desc())
+        else:
+            if after is not None:
+                stmt = stmt.where(Films.code > after)
+            stmt = stmt.order_by(Films.code)
+
+        async with self.async_session() as session:
+            films = (await session.execute(stmt)).all()
+        return films[::-1] if before is not None else films
+
+    async def import_films(self, rows: list[tuple]) -> int:
+        table = f'"{Films.__table__.schema}".{Films.__tablename__}'
+        columns = ', '.join(FILM_COLUMNS)
+        async with self.driver_connection() as conn:
+            async with conn.transaction():
+                create = f'CREATE TEMP TABLE films_import (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP'
+                with timed_sql(create):
+                    await conn.execute(create)
+                with timed_sql('COPY films_import'):
+                    await conn.copy_records_to_table('films_import', records=rows, columns=FILM_COLUMNS)
+                upsert = (
+                    f'INSERT INTO {table} ({columns}) SELECT {columns} FROM films_import '
+                    f'ON CONFLICT (code) DO UPDATE SET '
+                    + ', '.join(f'{column} = EXCLUDED.{column}' for column in FILM_COLUMNS[1:])
+                    + ', date_update = now()'
+                )
+                with timed_sql(upsert):
+                    status = await conn.execute(upsert)
+                notify = 'SELECT pg_notify($1, $2)'
+                with timed_sql(notify):
+                    await conn.execute(notify, FilmCatalog.channel, FilmCatalog.reload)
+        return int(status.split()[-1])
+
+    async def export_films(self, output, fmt: str = 'csv'):
+        table = f'"{Films.__table__.schema}".{Films.__tablename__}'
+        async with self.driver_connection() as conn:
+            if fmt == 'csv':
+                query = (
+                    f"SELECT code, title, description, array_to_string(links_view, ' ') AS links_view, source_url "
+                    f"FROM {table} ORDER BY code"
+                )
+                with timed_sql(f'COPY ({query})'):
+                    await conn.copy_from_query(query, output=output, format='csv', header=True)
+                return
+
+            async with conn.transaction():
+                output.write(b'[')
+                separator = b'\n'
+                query = f'SELECT {", ".join(FILM_COLUMNS)} FROM {table} ORDER BY code'
+                with timed_sql(query):
+                    async for record in conn.cursor(query, prefetch=1000):
+                        output.write(separator + json.dumps(dict(record), ensure_ascii=False).encode())
+                        separator = b',\n'
+                output.write(b'\n]\n')
+
+    async def add_film(self, film: Films):
+        async with self.async_session() as session:
+            async with session.begin():
+                session.add(film)
+                await self.__notify_film(session, film.code)
+        self.catalog.put(film)
 
     async def delete_film(self, film: Films):
-        await self.delete(film)
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.delete(film)
+                await self.__notify_film(session, film.code)
+        self.catalog.drop(film.code)
+
+    async def set_film_media(
+            self,
+            code: int,
+            media_type: str | None,
+            media_url: str | None,
+            file_id: str | None,
+            bot_id: int | None
+    ):
+        stmt = update(Films).where(Films.code == code).values(
+            media_type=media_type, media_url=media_url, media_file_id=file_id, media_bot_id=bot_id,
+            date_update=func.now()
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                result = await session.execute(stmt)
+                await self.__notify_film(session, code)
+        return result.rowcount > 0
+
+    async def set_media_file_id(self, code: int, file_id: str, bot_id: int):
+        stmt = update(Films).where(Films.code == code).values(media_file_id=file_id, media_bot_id=bot_id)
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
+                await self.__notify_film(session, code)
+
+    async def get_film_file(self, code: int, bot_id: int, source: str) -> str | None:
+        stmt = select(FilmFiles.file_id).where(
+            FilmFiles.code == code, FilmFiles.bot_id == bot_id, FilmFiles.source == source
+        )
+        return await self.__scalar(stmt, replica=True)
+
+    async def set_film_file(self, code: int, bot_id: int, source: str, file_id: str):
+        stmt = insert(FilmFiles).values(code=code, bot_id=bot_id, source=source, file_id=file_id)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FilmFiles.code, FilmFiles.bot_id],
+            set_={'source': stmt.excluded.source, 'file_id': stmt.excluded.file_id, 'date_update': func.now()}
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
+
+    @staticmethod
+    async def __notify_film(session: AsyncSession, code: int):
+        # delivered to the listeners only when the transaction commits
+        await session.execute(select(func.pg_notify(FilmCatalog.channel, str(code))))
+
+    async def create_broadcast(self, text: str, bot_id: int) -> Broadcasts:
+        broadcast = Broadcasts(
+            text=text, last_user_id=0, sent=0, blocked=0, failed=0, is_finished=False, bot_id=bot_id
+        )
+        await self.insert(broadcast)
+        return broadcast
+
+    async def get_unfinished_broadcasts(self) -> list[Broadcasts]:
+        stmt = select(Broadcasts).where(~Broadcasts.is_finished).order_by(Broadcasts.id)
+        return list(await self.__scalar(stmt, many=True))
+
+    async def save_broadcast(self, broadcast: Broadcasts):
+        stmt = update(Broadcasts).where(Broadcasts.id == broadcast.id).values(
+            last_user_id=broadcast.last_user_id,
+            sent=broadcast.sent,
+            blocked=broadcast.blocked,
+            failed=broadcast.failed,
+            is_finished=broadcast.is_finished
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
+
+    async def add_code_stats(self, rows: list[dict]):
+        stmt = insert(CodeStats).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CodeStats.code, CodeStats.hour],
+            set_={
+                'hits': CodeStats.hits + stmt.excluded.hits,
+                'misses': CodeStats.misses + stmt.excluded.misses,
+                'date_update': func.now()
+            }
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                await session.execute(stmt)
+
+    async def get_top_codes(self, days: int, limit: int = 10) -> tuple[list, list]:
+        # hours are stored as utc without a time zone, now() is converted to the same form
+        since = func.timezone('utc', func.now()) - timedelta(days=days)
+        hits = (
+            select(CodeStats.code, Films.title, func.sum(CodeStats.hits).label('count'))
+            .join(Films, Films.code == CodeStats.code)
+            .where(CodeStats.hour >= since)
+            .group_by(CodeStats.code, Films.title)
+            .order_by(func.sum(CodeStats.hits).desc())
+            .limit(limit)
+        )
+        misses = (
+            select(CodeStats.code, func.sum(CodeStats.misses).label('count'))
+            .where(CodeStats.hour >= since, CodeStats.misses > 0)
+            .group_by(CodeStats.code)
+            .order_by(func.sum(CodeStats.misses).desc())
+            .limit(limit)
+        )
+        async def top_codes(engine: AsyncEngine):
+            async with self.async_session(bind=engine) as session:
+                return (await session.execute(hits)).all(), (await session.execute(misses)).all()
+        return await self.__read(top_codes)
+
+    async def get_fsm(self, key: dict) -> tuple[str | None, dict | None] | None:
+        stmt = select(FsmStates.state, FsmStates.data).filter_by(**key)
+        async with self.async_session() as session:
+            row = (await session.execute(stmt)).first()
+        return None if row is None else tuple(row)
+
+    async def get_fsm_keys(self) -> list[tuple[int, int, int, str]]:
+        stmt = select(FsmStates.bot_id, FsmStates.chat_id, FsmStates.user_id, FsmStates.destiny).where(
+            FsmStates.state.is_not(None) | (func.coalesce(FsmStates.data, text("'{}'::jsonb")) != text("'{}'::jsonb"))
+        )
+        async with self.async_session() as session:
+            return [tuple(row) for row in await session.execute(stmt)]
+
+    async def set_fsm(self, key: dict, **values) -> bool:
+        stmt = insert(FsmStates).values(**key, **values).on_conflict_do_update(
+            index_elements=list(key),
+            set_=dict(values, date_update=func.now())
+        ).returning(FsmStates.state, FsmStates.data)
+        async with self.async_session() as session:
+            async with session.begin():
+                state, data = (await session.execute(stmt)).one()
+                live = state is not None or bool(data)
+                await self.__notify_fsm(session, key, live)
+        return live
+
+    async def count_fsm(self) -> int:
+        stmt = select(func.count()).select_from(FsmStates).where(FsmStates.state.is_not(None))
+        return await self.__scalar(stmt)
+
+    async def delete_expired_fsm(self, ttl: int) -> int:
+        stmt = delete(FsmStates).where(FsmStates.date_update < func.now() - timedelta(seconds=ttl)).returning(
+            FsmStates.bot_id, FsmStates.chat_id, FsmStates.user_id, FsmStates.destiny
+        )
+        async with self.async_session() as session:
+            async with session.begin():
+                keys = (await session.execute(stmt)).all()
+                for key in keys:
+                    await self.__notify_fsm(session, key._asdict(), False)
+        return len(keys)
+
+    @staticmethod
+    async def __notify_fsm(session: AsyncSession, key: dict, live: bool):
+        payload = json.dumps([key['bot_id'], key['chat_id'], key['user_id'], key['destiny'], live])
+        await session.execute(select(func.pg_notify(FsmStates.channel, payload)))
 
     async def create_tables(self):
         self.logger.info('Create tables')
         async with self.engine.begin() as conn:  # type: AsyncConnection
+            # a lock held by a long transaction fails the start instead of queueing every query behind it,
+            # the start is retried
+            await conn.execute(text("SET LOCAL lock_timeout = '1s'"))
             await conn.run_sync(Base.metadata.create_all)
+            schema = Base.__table_args__['schema']
+            columns = set((await conn.execute(COLUMNS_QUERY, {'schema': schema})).all())
+            for model, column, definition in MIGRATIONS:
+                if (model.__tablename__, column) not in columns:
+                    self.logger.info('Add column', extra={'table': model.__tablename__, 'column': column})
+                    await conn.execute(text(
+                        f'ALTER TABLE "{schema}".{model.__tablename__} ADD COLUMN IF NOT EXISTS {column} {definition}'
+                    ))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+        await self.engine.dispose()
 
     async def drop_tables(self):
         self.logger.info('Drop tables')
@@ -0,0 +1,241 @@
+import asyncio
+from logging import Logger
+
+from aiogram.types import User
+
+from lib.bot.forwarder import LogForwarder
+from lib.cache import TTLCache
+from lib.postgres import Postgres
+
+
+class UserRegistry:
+    flush_interval = 2
+    batch_size = 500
+    # new users beyond this wait for a later /start while postgres is down
+    max_pending = 10_000
+    digest_interval = 60
+    retry_interval = 5
+
+    def __init__(self, postgres: Postgres, logger: Logger, main_bot_id: int):
+        self.postgres = postgres
+        self.logger = logger
+        self.main_bot_id = main_bot_id
+        self.forwarder: LogForwarder | None = None
+
+        # active users of the main bot and (bot id, user id) of the mirrors' users
+        self.known: set[int] = set()
+        self.members: set[tuple[int, int]] = set()
+        self.ready = False
+
+        self._pending: dict[int, dict] = {}
+        self._pending_members: dict[tuple[int, int], dict] = {}
+        self._digest: list[str] = []
+        self._flushed = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending) + len(self._pending_members)
+
+    def start(self, forwarder: LogForwarder | None):
+        # until the known users are loaded every /start is checked in postgres
+        self.forwarder = forwarder
+        self._tasks = [
+            asyncio.create_task(self._load()),
+            asyncio.create_task(self._flush_loop()),
+            asyncio.create_task(self._digest_loop())
+        ]
+
+    async def _load(self):
+        while True:
+            try:
+                known = await self.postgres.get_user_ids()
+                members = await self.postgres.get_bot_users()
+                break
+            except Exception as ex:
+                self.logger.error('Error load known users', extra={'ex': ex})
+                await asyncio.sleep(self.retry_interval)
+
+        # users flushed during the load are known already
+        self.known.update(known)
+        self.members.update(members)
+        self.ready = True
+        self.logger.info('Known users loaded', extra={'users': len(self.known), 'members': len(self.members)})
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        await self.flush()
+        self.send_digest()
+
+    async def register(self, from_user: User, is_admin: bool, bot_id: int) -> bool:
+        # a user of a mirror gets a bot_users row and an inactive users row, so the main bot does not broadcast to them
+        mirror = bot_id != self.main_bot_id
+        member = (bot_id, from_user.id)
+        if mirror and (member in self.members or member in self._pending_members):
+            return False
+        new_user = from_user.id not in self.known and from_user.id not in self._pending
+        if not mirror and not new_user:
+            if from_user.id in self._pending:
+                # came to a mirror first and to the main bot before the flush
+                self._pending[from_user.id]['is_active'] = True
+            return False
+        if self.pending >= self.max_pending:
+            self.logger.warning('Too many users waiting for insert', extra={'user_id': from_user.id})
+            return False
+        if new_user and not self.ready and await self.postgres.get_user(from_user.id) is not None:
+            if not mirror:
+                return False
+            new_user = False
+
+        if mirror:
+            self._pending_members[member] = dict(bot_id=bot_id, user_id=from_user.id)
+        if new_user:
+            self._pending[from_user.id] = dict(
+                user_id=from_user.id,
+                is_bot=from_user.is_bot,
+                first_name=from_user.first_name,
+                last_name=from_user.last_name,
+                username=from_user.username,
+                # optional in telegram and longer than the column for tags like zh-hans
+                language_code=(from_user.language_code or '')[:5],
+                is_premium=from_user.is_premium,
+                is_admin=is_admin,
+                is_active=not mirror
+            )
+        self._digest.append(from_user.first_name)
+        if self.pending >= self.batch_size:
+            self._flushed.set()
+        return True
+
+    def forget(self, user_ids: list[int], bot_id: int):
+        # deactivated users are registered again on their next /start
+        if bot_id == self.main_bot_id:
+            self.known.difference_update(user_ids)
+        else:
+            self.members.difference_update((bot_id, user_id) for user_id in user_ids)
+
+    async def flush(self):
+        # users first, a member row of a mirror is useless without its user
+        if await self._flush(self._pending, self.postgres.insert_users, self.known):
+            await self._flush(self._pending_members, self.postgres.insert_bot_users, self.members)
+
+    async def _flush(self, pending: dict, insert, known: set) -> bool:
+        while pending:
+            batch = list(pending.items())[:self.batch_size]
+            try:
+                await insert([row for _, row in batch])
+            except Exception as ex:
+                self.logger.error('Error insert users', extra={'ex': ex, 'users': len(batch)})
+                if not self._bad_row(ex) or not await self._insert_each(batch, pending, insert, known):
+                    return False
+                continue
+            self._inserted(batch, pending, known)
+        return True
+
+    async def _insert_each(self, batch: list, pending: dict, insert, known: set) -> bool:
+        # one bad row fails the whole batch, so the batch is retried row by row and the bad rows are dropped
+        for key, row in batch:
+            try:
+                await insert([row])
+            except Exception as ex:
+                if not self._bad_row(ex):
+                    return False
+                self.logger.error('Error insert user', extra={'ex': ex, 'user_id': row['user_id']})
+                pending.pop(key, None)
+            else:
+                self._inserted([(key, row)], pending, known)
+        return True
+
+    @staticmethod
+    def _inserted(batch: list, pending: dict, known: set):
+        for key, row in batch:
+            pending.pop(key, None)
+            # a user of a mirror only is still unknown to the main bot
+            if row.get('is_active', True):
+                known.add(key)
+
+    @staticmethod
+    def _bad_row(ex: Exception) -> bool:
+        # data exceptions and constraint violations, unlike a lost connection, fail on every retry
+        sqlstate = getattr(getattr(ex, 'orig', None), 'sqlstate', None) or ''
+        return sqlstate[:2] in ('22', '23')
+
+    def send_digest(self):
+        names, self._digest = self._digest, []
+        if names and self.forwarder is not None:
+            self.forwarder.put(f'Новых пользователей: {len(names)}\n' + '\n'.join(names))
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flushed.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flushed.clear()
+            await self.flush()
+
+    async def _digest_loop(self):
+        while True:
+            await asyncio.sleep(self.digest_interval)
+            self.send_digest()
+
+
+class AdminCache:
+    refresh_interval = 300
+    retry_interval = 5
+    not_admin_ttl = 60
+
+    def __init__(self, postgres: Postgres, logger: Logger):
+        self.postgres = postgres
+        self.logger = logger
+
+        self.admins: set[int] = set()
+        self.ready = False
+        self.not_admins = TTLCache()
+
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        # until the first load admins are looked up one by one
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def load(self):
+        self.admins = await self.postgres.get_admin_ids()
+        self.ready = True
+        self.not_admins.clear()
+        self.logger.info('Admins loaded', extra={'admins': len(self.admins)})
+
+    def add(self, user_id: int):
+        self.admins.add(user_id)
+        self.not_admins.pop(user_id)
+
+    async def is_admin(self, user_id: int) -> bool:
+        if user_id in self.admins:
+            return True
+        if self.ready or self.not_admins.get(user_id):
+            return False
+
+        is_admin = bool(await self.postgres.get_admin(user_id))
+        if is_admin:
+            self.admins.add(user_id)
+        else:
+            self.not_admins.set(user_id, True, self.not_admin_ttl)
+        return is_admin
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.load()
+            except Exception as ex:
+                self.logger.error('Error refresh admins', extra={'ex': ex})
+            await asyncio.sleep(self.refresh_interval if self.ready else self.retry_interval)
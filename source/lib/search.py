@@ -0,0 +1,58 @@
+import re
+from collections import Counter, defaultdict
+
+WORD = re.compile(r'\w+')
+
+
+def trigrams(text: str) -> set[str]:
+    grams = set()
+    # the same padding as pg_trgm, so word starts weigh more than the middle
+    for word in WORD.findall(text.lower().replace('ё', 'е')):
+        word = f'  {word} '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.postings: dict[str, set[int]] = defaultdict(set)
+        self.grams: dict[int, set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.grams)
+
+    def add(self, key: int, text: str):
+        self.remove(key)
+        grams = trigrams(text)
+        self.grams[key] = grams
+        for gram in grams:
+            self.postings[gram].add(key)
+
+    def remove(self, key: int):
+        for gram in self.grams.pop(key, ()):
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def clear(self):
+        self.postings.clear()
+        self.grams.clear()
+
+    def search(self, query: str, limit: int = 5, threshold: float = 0.2) -> list[tuple[int, float]]:
+        grams = trigrams(query)
+        if not grams:
+            return []
+
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        scores = []
+        for key, count in shared.items():
+            # word similarity: how much of the query is found in the text
+            score = count / len(grams)
+            if score >= threshold:
+                scores.append((key, score, count / len(self.grams[key])))
+        scores.sort(key=lambda item: (item[1], item[2]), reverse=True)
+        return [(key, score) for key, score, _ in scores[:limit]]
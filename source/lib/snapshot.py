@@ -0,0 +1,113 @@
+import bisect
+import mmap
+import os
+import struct
+import time
+from logging import Logger
+from pathlib import Path
+
+
+class CatalogSnapshot:
+    # header (magic, stamp, count), entries sorted by code (code, offset, title length, text length),
+    # then utf-8 titles and texts
+    magic = b'FBC1'
+    header = struct.Struct('<4sQI')
+    entry = struct.Struct('<IIII')
+
+    def __init__(self, path: str, logger: Logger):
+        self.path = Path(path)
+        self.logger = logger
+
+        self.stamp = 0
+        self.count = 0
+        self._map: mmap.mmap | None = None
+        self._data = 0
+
+    @property
+    def available(self) -> bool:
+        return self._map is not None
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.stamp / 1e9
+
+    def open(self) -> bool:
+        try:
+            with open(self.path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as ex:
+            self.logger.warning('Error open catalog snapshot', extra={'path': str(self.path), 'ex': ex})
+            return False
+
+        magic, stamp, count = self.header.unpack_from(data) if len(data) >= self.header.size else (None, 0, 0)
+        if magic != self.magic or len(data) < self.header.size + count * self.entry.size:
+            self.logger.warning('Catalog snapshot is corrupted', extra={'path': str(self.path)})
+            data.close()
+            return False
+
+        self.close()
+        self._map = data
+        self.stamp = stamp
+        self.count = count
+        self._data = self.header.size + count * self.entry.size
+        return True
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self.count = 0
+
+    def get(self, code: int) -> str | None:
+        index = self._find(code)
+        if index == self.count:
+            return None
+        found, offset, title_length, text_length = self._entry(index)
+        if found != code:
+            return None
+        start = self._data + offset + title_length
+        return self._map[start:start + text_length].decode()
+
+    def page(self, limit: int, after: int | None = None, before: int | None = None) -> list[tuple[int, str]]:
+        if before is not None:
+            end = self._find(before)
+            indexes = range(max(end - limit, 0), end)
+        else:
+            start = 0 if after is None else self._find(after + 1)
+            indexes = range(start, min(start + limit, self.count))
+        return [self._title(index) for index in indexes]
+
+    @classmethod
+    def write(cls, path: str | Path, films: dict[int, str], titles: dict[int, str]):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        entries, blobs, offset = [], [], 0
+        for code in sorted(films):
+            title, text = titles[code].encode(), films[code].encode()
+            entries.append(cls.entry.pack(code, offset, len(title), len(text)))
+            blobs += (title, text)
+            offset += len(title) + len(text)
+
+        # readers keep their mapping of the old file, the new one replaces it atomically
+        temp = path.with_name(path.name + '.tmp')
+        with open(temp, 'wb') as file:
+            file.write(cls.header.pack(cls.magic, time.time_ns(), len(entries)))
+            file.writelines(entries)
+            file.writelines(blobs)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, path)
+
+    def _entry(self, index: int) -> tuple[int, int, int, int]:
+        return self.entry.unpack_from(self._map, self.header.size + index * self.entry.size)
+
+    def _title(self, index: int) -> tuple[int, str]:
+        code, offset, title_length, _ = self._entry(index)
+        start = self._data + offset
+        return code, self._map[start:start + title_length].decode()
+
+    def _find(self, code: int) -> int:
+        return bisect.bisect_left(range(self.count), code, key=lambda index: self._entry(index)[0])
@@ -0,0 +1,43 @@
+from lib.cache import TTLCache
+
+
+def test_get_before_and_after_ttl(clock):
+    cache = TTLCache()
+    cache.set('key', 'value', 10)
+    assert cache.get('key') == 'value'
+
+    clock.advance(11)
+    assert cache.get('key') is None
+    assert cache.get('key', 'default') == 'default'
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_set(clock):
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1, 10)
+    cache.set('b', 2, 10)
+    cache.set('a', 3, 10)
+    cache.set('c', 4, 10)
+
+    assert list(cache.keys()) == ['a', 'c']
+    assert cache.get('b') is None
+
+
+def test_falsy_values_are_cached(clock):
+    cache = TTLCache()
+    cache.set('zero', 0, 10)
+    cache.set('false', False, 10)
+
+    assert cache.get('zero', 'miss') == 0
+    assert cache.get('false', 'miss') is False
+
+
+def test_pop_and_clear(clock):
+    cache = TTLCache()
+    cache.set('a', 1, 10)
+    cache.set('b', 2, 10)
+
+    assert cache.pop('a') == 1
+    assert cache.pop('a', 'missing') == 'missing'
+    cache.clear()
+    assert len(cache) == 0
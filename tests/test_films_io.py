@@ -0,0 +1,58 @@
+import json
+
+from lib.films_io import parse_films
+
+
+def test_csv():
+    data = (
+        '﻿code,title,description,links_view,source_url\n'
+        '12,Film,About,https://a https://b,https://source\n'
+        '0,Zero,,,\n'
+    ).encode()
+    rows, errors = parse_films(data, 'films.csv')
+
+    assert errors == []
+    assert rows == [
+        (12, 'Film', 'About', ['https://a', 'https://b'], 'https://source'),
+        (0, 'Zero', None, None, None)
+    ]
+
+
+def test_json():
+    data = json.dumps([
+        {'code': 0, 'title': 'Zero'},
+        {'code': '7', 'title': ' Seven ', 'links_view': ['https://a']}
+    ]).encode()
+    rows, errors = parse_films(data, 'films.JSON')
+
+    assert errors == []
+    assert rows == [(0, 'Zero', None, None, None), (7, 'Seven', None, ['https://a'], None)]
+
+
+def test_errors_keep_valid_rows():
+    data = json.dumps([
+        {'title': 'No code'},
+        {'code': 12345, 'title': 'Long code'},
+        {'code': 1, 'title': ''},
+        {'code': 2, 'title': 'Film', 'links_view': [1]},
+        {'code': 3, 'title': 'Film'},
+        {'code': 3, 'title': 'Duplicate'},
+        'not an object'
+    ]).encode()
+    rows, errors = parse_films(data, 'films.json')
+
+    assert rows == [(3, 'Film', None, None, None)]
+    assert [error.split(':')[0] for error in errors] == ['1', '2', '3', '4', '6', '7']
+
+
+def test_csv_lines_count_the_header():
+    rows, errors = parse_films(b'code,title\n1,Film\nx,Bad\n', 'films.csv')
+
+    assert rows == [(1, 'Film', None, None, None)]
+    assert errors == ["3: некорректный код 'x'"]
+
+
+def test_unreadable_file():
+    assert parse_films(b'{"code": 1}', 'films.json') == ([], ['Ожидается список объектов'])
+    rows, errors = parse_films(b'[', 'films.json')
+    assert rows == [] and errors[0].startswith('Не удалось прочитать файл')
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from aiogram.types import ChatMemberLeft, ChatMemberMember, User
+
+from lib.bot.filters import PubFilter
+
+CHANNEL_ID = -1001
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def get_chat(self, chat_id):
+        self.calls.append(('get_chat', chat_id))
+        await asyncio.sleep(0)
+        return SimpleNamespace(id=CHANNEL_ID)
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls.append(('get_chat_member', chat_id))
+        return ChatMemberMember(user=User(id=user_id, is_bot=False, first_name='user'))
+
+
+def member_update(user_id: int, member: bool) -> SimpleNamespace:
+    user = User(id=user_id, is_bot=False, first_name='user')
+    status = ChatMemberMember(user=user) if member else ChatMemberLeft(user=user)
+    # a channel configured by username, the update carries the numeric id
+    return SimpleNamespace(chat=SimpleNamespace(id=CHANNEL_ID, username='movies'), new_chat_member=status)
+
+
+def test_configured_names_share_the_numeric_key():
+    async def run():
+        pub_filter, bot = PubFilter(logging.getLogger('test')), FakeBot()
+        # concurrent first checks resolve the channel once
+        assert all(await asyncio.gather(*[pub_filter.check(bot, 1, [{'chat_id': '@Movies'}]) for _ in range(3)]))
+        assert await pub_filter.check(bot, 1, [{'chat_id': '@movies'}])
+        assert await pub_filter.check(bot, 1, [{'chat_id': CHANNEL_ID}])
+        assert bot.calls.count(('get_chat', '@Movies')) == 1
+
+        pub_filter.update_member(member_update(1, member=False))
+        assert not await pub_filter.check(bot, 1, [{'chat_id': '@MOVIES'}])
+
+        pub_filter.forget_channel(member_update(1, member=False))
+        assert await pub_filter.check(bot, 1, [{'chat_id': str(CHANNEL_ID)}])
+        assert bot.calls[-1] == ('get_chat_member', CHANNEL_ID)
+
+    asyncio.run(run())
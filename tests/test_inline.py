@@ -0,0 +1,41 @@
+import asyncio
+
+from lib.bot.inline import InlineResults
+
+
+class FakeCatalog:
+    def __init__(self):
+        self.version = 0
+        self.ready = asyncio.Event()
+        self.films = {}
+        self.titles = {}
+        # what get finds before the first load, e.g. in the snapshot
+        self.fallback = {7: 'Название: Snapshot film\n'}
+
+    async def get(self, code: int) -> str | None:
+        return self.films.get(code) if self.ready.is_set() else self.fallback.get(code)
+
+    def search(self, query: str, limit: int) -> list[tuple[int, str]]:
+        return [(code, title) for code, title in self.titles.items() if query in title.lower()][:limit]
+
+
+def test_before_the_first_load():
+    async def run():
+        catalog = FakeCatalog()
+        results = InlineResults(catalog)
+
+        found, complete = await results.get('7')
+        assert not complete
+        assert [(item.id, item.description) for item in found] == [('7', 'Название: Snapshot film')]
+        assert await results.get('8') == ([], False)
+        assert await results.get('film') == ([], False)
+        assert len(results.queries) == 0
+
+        catalog.films, catalog.titles = {8: 'Название: Loaded film\n'}, {8: 'Loaded film'}
+        catalog.ready.set()
+        found, complete = await results.get('8')
+        assert complete and [item.title for item in found] == ['8 - Loaded film']
+        found, _ = await results.get('loaded')
+        assert [item.id for item in found] == ['8']
+
+    asyncio.run(run())
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+from lib.bot.scheduler import Lane, SendScheduler, TokenBucket
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(rate=2, capacity=2)
+    for _ in range(2):
+        assert bucket.delay(clock()) == 0
+        bucket.take()
+    assert bucket.delay(clock()) == 0.5
+
+    clock.advance(0.5)
+    assert bucket.delay(clock()) == 0
+    bucket.take()
+
+    clock.advance(100)
+    bucket.delay(clock())
+    assert bucket.tokens == 2
+
+
+def test_token_bucket_pause(clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.pause(5)
+    assert bucket.delay(clock()) == 5
+
+    clock.advance(5)
+    assert bucket.delay(clock()) == 0
+
+
+def test_chat_buckets_are_per_bot():
+    scheduler = SendScheduler(logging.getLogger('test'))
+
+    assert scheduler._chat_bucket(1, 100) is scheduler._chat_bucket(1, 100)
+    assert scheduler._chat_bucket(1, 100) is not scheduler._chat_bucket(2, 100)
+    assert scheduler._chat_bucket(1, 100).rate == scheduler.private_rate
+    assert scheduler._chat_bucket(1, -100).rate == scheduler.group_rate
+    assert scheduler._chat_bucket(1, '@channel').rate == scheduler.group_rate
+    assert scheduler._global_bucket(1) is not scheduler._global_bucket(2)
+
+
+def test_replies_go_before_broadcasts():
+    async def run() -> list[str]:
+        scheduler = SendScheduler(logging.getLogger('test'), global_rate=20)
+        # no tokens left, all three wait and the next token goes by priority
+        scheduler._global_bucket(1).tokens = 0
+        order = []
+
+        async def send(name: str, priority: Lane):
+            await scheduler.acquire(1, None, priority)
+            order.append(name)
+
+        await asyncio.gather(send('broadcast', Lane.BROADCAST), send('log', Lane.LOG), send('reply', Lane.REPLY))
+        await scheduler.close()
+        return order
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == ['reply', 'log', 'broadcast']
+
+
+def test_one_chat_does_not_hold_back_others():
+    async def run() -> tuple[list[int], dict]:
+        scheduler = SendScheduler(logging.getLogger('test'), global_rate=100)
+        scheduler.private_rate = 10
+        await scheduler.acquire(1, 10)
+        order = []
+
+        async def send(chat_id: int):
+            await scheduler.acquire(1, chat_id)
+            order.append(chat_id)
+
+        # chat 10 waits for its own bucket, chat 20 is sent at once
+        await asyncio.gather(send(10), send(20))
+        await scheduler.close()
+        return order, scheduler.stats
+
+    order, stats = asyncio.run(asyncio.wait_for(run(), 10))
+    assert order == [20, 10]
+    assert stats['sent'] == 3
+    assert stats['wait_max'] >= 0.09
@@ -0,0 +1,46 @@
+from lib.search import TrigramIndex, trigrams
+
+
+def make_index() -> TrigramIndex:
+    index = TrigramIndex()
+    index.add(1, 'Интерстеллар')
+    index.add(2, 'Ёлки')
+    index.add(3, 'Начало')
+    index.add(4, 'Начало конца')
+    return index
+
+
+def test_trigrams_are_padded_like_pg_trgm():
+    assert trigrams('Cat') == {'  c', ' ca', 'cat', 'at '}
+
+
+def test_search_tolerates_typos():
+    assert make_index().search('интерстелар')[0][0] == 1
+
+
+def test_yo_matches_ye():
+    assert make_index().search('елки')[0] == (2, 1.0)
+
+
+def test_shorter_title_wins_a_tie():
+    assert [key for key, _ in make_index().search('начало')] == [3, 4]
+
+
+def test_threshold_and_limit():
+    index = make_index()
+    assert index.search('матрица') == []
+    assert len(index.search('начало', limit=1)) == 1
+    assert index.search('!!!') == []
+
+
+def test_readd_and_remove():
+    index = make_index()
+    index.add(1, 'Матрица')
+    assert index.search('интерстеллар') == []
+    assert index.search('матрица')[0][0] == 1
+
+    index.remove(1)
+    index.remove(1)
+    assert len(index) == 3
+    assert index.search('матрица') == []
+    assert all(1 not in keys for keys in index.postings.values())
@@ -0,0 +1,71 @@
+import logging
+
+from lib.snapshot import CatalogSnapshot
+
+FILMS = {code: f'Film {code}\nОписание' for code in (1, 5, 9, 42, 1000)}
+TITLES = {code: f'Фильм {code}' for code in FILMS}
+
+
+def open_snapshot(tmp_path) -> CatalogSnapshot:
+    path = tmp_path / 'data' / 'catalog.snapshot'
+    CatalogSnapshot.write(path, FILMS, TITLES)
+    snapshot = CatalogSnapshot(str(path), logging.getLogger('test'))
+    assert snapshot.open()
+    return snapshot
+
+
+def test_get(tmp_path):
+    snapshot = open_snapshot(tmp_path)
+
+    assert snapshot.count == len(FILMS)
+    assert snapshot.age < 60
+    for code, text in FILMS.items():
+        assert snapshot.get(code) == text
+    for code in (0, 2, 43, 1001):
+        assert snapshot.get(code) is None
+
+
+def test_page(tmp_path):
+    snapshot = open_snapshot(tmp_path)
+
+    assert snapshot.page(2) == [(1, 'Фильм 1'), (5, 'Фильм 5')]
+    assert snapshot.page(2, after=5) == [(9, 'Фильм 9'), (42, 'Фильм 42')]
+    assert snapshot.page(2, after=42) == [(1000, 'Фильм 1000')]
+    assert snapshot.page(2, before=42) == [(5, 'Фильм 5'), (9, 'Фильм 9')]
+    assert snapshot.page(2, before=5) == [(1, 'Фильм 1')]
+    assert snapshot.page(2, after=1000) == []
+
+
+def test_rewrite_replaces_the_open_file(tmp_path):
+    snapshot = open_snapshot(tmp_path)
+    CatalogSnapshot.write(snapshot.path, {7: 'Seven'}, {7: 'Seven'})
+
+    # the old mapping stays readable until the snapshot is opened again
+    assert snapshot.get(42) == FILMS[42]
+    assert snapshot.open()
+    assert snapshot.get(42) is None
+    assert snapshot.get(7) == 'Seven'
+
+
+def test_empty_catalog(tmp_path):
+    path = tmp_path / 'catalog.snapshot'
+    CatalogSnapshot.write(path, {}, {})
+    snapshot = CatalogSnapshot(str(path), logging.getLogger('test'))
+
+    assert snapshot.open()
+    assert snapshot.get(1) is None
+    assert snapshot.page(25) == []
+
+
+def test_missing_and_corrupted(tmp_path):
+    snapshot = CatalogSnapshot(str(tmp_path / 'catalog.snapshot'), logging.getLogger('test'))
+    assert not snapshot.open()
+    assert not snapshot.available
+
+    (tmp_path / 'catalog.snapshot').write_bytes(b'FBC0' + bytes(100))
+    assert not snapshot.open()
+
+    good = open_snapshot(tmp_path)
+    data = good.path.read_bytes()
+    good.path.write_bytes(data[:CatalogSnapshot.header.size + 10])
+    assert not CatalogSnapshot(str(good.path), logging.getLogger('test')).open()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+
+from aiogram.fsm.storage.base import StorageKey
+
+from lib.bot.storage import PostgresStorage
+
+KEY = StorageKey(bot_id=1, chat_id=2, user_id=2)
+ITEM = (1, 2, 2, 'default')
+
+
+class FakePostgres:
+    def __init__(self):
+        self.rows = {}
+        self.reads = 0
+
+    async def get_fsm(self, key: dict):
+        self.reads += 1
+        return self.rows.get(tuple(key.values()))
+
+    async def set_fsm(self, key: dict, state=..., data=...) -> bool:
+        old_state, old_data = self.rows.get(tuple(key.values()), (None, None))
+        row = (old_state if state is ... else state, old_data if data is ... else data)
+        self.rows[tuple(key.values())] = row
+        return row[0] is not None or bool(row[1])
+
+
+def storage() -> tuple[PostgresStorage, FakePostgres]:
+    postgres = FakePostgres()
+    result = PostgresStorage(postgres, logging.getLogger('test'))
+    result.ready = True
+    return result, postgres
+
+
+def test_users_without_state_are_not_read():
+    async def run():
+        fsm, postgres = storage()
+        for _ in range(50):
+            assert await fsm.get_state(KEY) is None
+            assert await fsm.get_data(KEY) == {}
+        assert postgres.reads == 0
+
+        await fsm.set_state(KEY, 'Wizard:code')
+        await fsm.set_data(KEY, {'code': 5})
+        assert await fsm.get_state(KEY) == 'Wizard:code'
+        assert await fsm.get_data(KEY) == {'code': 5}
+        assert postgres.reads == 2
+
+        await fsm.set_state(KEY, None)
+        await fsm.set_data(KEY, {})
+        assert await fsm.get_state(KEY) is None
+        assert postgres.reads == 2
+
+    asyncio.run(run())
+
+
+def test_everyone_is_read_until_the_keys_are_loaded():
+    async def run():
+        fsm, postgres = storage()
+        fsm.ready = False
+        assert await fsm.get_state(KEY) is None
+        assert postgres.reads == 1
+
+    asyncio.run(run())
+
+
+def test_writes_of_other_processes():
+    fsm, _ = storage()
+    fsm._on_notify(None, 0, 'fsm', json.dumps([*ITEM, True]))
+    assert ITEM in fsm.live
+    fsm._on_notify(None, 0, 'fsm', json.dumps([*ITEM, False]))
+    assert ITEM not in fsm.live
+
+    # notified during the load, applied over it afterwards
+    fsm._loading = []
+    fsm._on_notify(None, 0, 'fsm', json.dumps([*ITEM, True]))
+    assert fsm._loading == [(ITEM, True)] and ITEM not in fsm.live
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from lib.bot.throttling import ThrottlingMiddleware
+
+
+def make_middleware(**kwargs) -> ThrottlingMiddleware:
+    return ThrottlingMiddleware(logging.getLogger('test'), **{'rate': 1, 'burst': 3, 'ban_time': 60, **kwargs})
+
+
+def test_burst_then_rate(clock):
+    throttling = make_middleware()
+
+    assert [throttling.allow(1, str(index)) for index in range(4)] == [True, True, True, False]
+    assert throttling.allow(2, 'other user')
+
+    clock.advance(1)
+    assert throttling.allow(1, 'after a second')
+    assert not throttling.allow(1, 'too fast')
+    assert throttling.stats['throttled'] == 2
+
+
+def test_duplicates_within_window(clock):
+    throttling = make_middleware(burst=10)
+
+    assert throttling.allow(1, '123')
+    assert not throttling.allow(1, '123')
+    assert throttling.allow(1, '456')
+    assert throttling.allow(1, '123')
+
+    clock.advance(throttling.duplicate_window)
+    assert throttling.allow(1, '123')
+    # updates without text, e.g. photos, are never duplicates
+    assert throttling.allow(1, None)
+    assert throttling.allow(1, None)
+    assert throttling.stats['duplicates'] == 1
+
+
+def test_ban_after_strikes(clock):
+    throttling = make_middleware(burst=1)
+    assert throttling.allow(1, 'first')
+    for index in range(throttling.max_strikes):
+        assert not throttling.allow(1, str(index))
+    assert throttling.stats['bans'] == 1
+
+    clock.advance(30)
+    assert not throttling.allow(1, 'still banned')
+    assert throttling.stats['banned'] == 1
+
+    clock.advance(31)
+    assert throttling.allow(1, 'ban is over')
+
+
+def test_allowed_update_resets_strikes(clock):
+    throttling = make_middleware(burst=1)
+    for attempt in range(3):
+        assert throttling.allow(1, f'text {attempt}')
+        for index in range(throttling.max_strikes - 1):
+            assert not throttling.allow(1, str(index))
+        clock.advance(1)
+    assert throttling.stats['bans'] == 0
+
+
+def test_drops_updates_before_the_handler(clock):
+    async def run() -> list[int]:
+        throttling = make_middleware(burst=1)
+        data = {'event_from_user': SimpleNamespace(id=1), 'admins': SimpleNamespace(admins={2})}
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event.update_id)
+
+        for update_id, text in enumerate(['a', 'b', 'c']):
+            event = SimpleNamespace(update_id=update_id, event_type='message', message=SimpleNamespace(text=text))
+            await throttling(handler, event, data)
+        # other updates and admins are never dropped
+        await throttling(handler, SimpleNamespace(update_id=3, event_type='inline_query'), data)
+        event = SimpleNamespace(update_id=4, event_type='message', message=SimpleNamespace(text='a'))
+        await throttling(handler, event, {**data, 'event_from_user': SimpleNamespace(id=2)})
+        return handled
+
+    assert asyncio.run(run()) == [0, 3, 4]
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+from aiogram.types import ErrorEvent, Message, Update
+
+from lib.bot.updates import UpdateScheduler
+
+BOT = SimpleNamespace(id=1)
+
+
+def update(update_id: int, user_id: int, event_type: str = 'message') -> tuple[SimpleNamespace, dict]:
+    event = SimpleNamespace(update_id=update_id, event_type=event_type, message=None)
+    return event, {'bot': BOT, 'event_from_user': SimpleNamespace(id=user_id)}
+
+
+def test_one_user_in_order_users_in_parallel():
+    async def run() -> tuple[list, int]:
+        scheduler = UpdateScheduler(logging.getLogger('test'), workers=4, max_in_flight=10)
+        handled, running, peak = [], set(), 0
+
+        async def handler(event, data):
+            nonlocal peak
+            user_id = data['event_from_user'].id
+            assert user_id not in running
+            running.add(user_id)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.01 * (event.update_id % 3))
+            running.discard(user_id)
+            handled.append((user_id, event.update_id))
+
+        for update_id in range(9):
+            await scheduler(handler, *update(update_id, user_id=update_id % 3))
+        await scheduler.close()
+        return handled, peak
+
+    handled, peak = asyncio.run(asyncio.wait_for(run(), 10))
+    for user_id in range(3):
+        assert [update_id for user, update_id in handled if user == user_id] == [user_id, user_id + 3, user_id + 6]
+    assert peak == 3
+
+
+def test_inline_queries_are_not_queued_behind_each_other():
+    async def run() -> list[int]:
+        scheduler = UpdateScheduler(logging.getLogger('test'), workers=1, max_in_flight=10)
+        started = []
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            started.append(event.update_id)
+            await release.wait()
+
+        for update_id in range(3):
+            await scheduler(handler, *update(update_id, user_id=1, event_type='inline_query'))
+        await asyncio.sleep(0.01)
+        # none of them holds the only worker, a message of the same user still runs
+        await scheduler(handler, *update(3, user_id=1))
+        await asyncio.sleep(0.01)
+        result = list(started)
+        release.set()
+        await scheduler.close()
+        return result
+
+    assert asyncio.run(asyncio.wait_for(run(), 10)) == [0, 1, 2, 3]
+
+
+def test_backpressure_and_errors():
+    async def run() -> tuple[bool, dict]:
+        scheduler = UpdateScheduler(logging.getLogger('test'), workers=2, max_in_flight=2)
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            await release.wait()
+            if event.update_id == 0:
+                raise ValueError('handler error')
+
+        await scheduler(handler, *update(0, user_id=1))
+        await scheduler(handler, *update(1, user_id=2))
+        third = asyncio.create_task(scheduler(handler, *update(2, user_id=3)))
+        await asyncio.sleep(0.01)
+        blocked = not third.done()
+
+        release.set()
+        await third
+        await scheduler.close()
+        return blocked, scheduler.stats
+
+    blocked, stats = asyncio.run(asyncio.wait_for(run(), 10))
+    assert blocked
+    assert stats == {'processed': 2, 'shed': 0, 'errors': 1}
+
+
+def test_stale_updates_are_shed(clock):
+    async def run() -> tuple[list, dict]:
+        scheduler = UpdateScheduler(logging.getLogger('test'), workers=1, max_in_flight=10, max_age=5)
+        handled = []
+
+        async def slow(event, data):
+            clock.advance(10)
+            handled.append(event.update_id)
+
+        await scheduler(slow, *update(0, user_id=1))
+        await scheduler(slow, *update(1, user_id=1))
+        await scheduler(slow, *update(2, user_id=1, event_type='chat_member'))
+        await scheduler.close()
+        return handled, scheduler.stats
+
+    handled, stats = asyncio.run(run())
+    # the second message waited behind the first one for too long, member updates are never shed
+    assert handled == [0, 2]
+    assert stats['shed'] == 1
+
+
+def test_errors_reach_the_dispatcher_error_handlers():
+    async def run() -> tuple[list, dict]:
+        scheduler = UpdateScheduler(logging.getLogger('test'), workers=1, max_in_flight=10)
+        dp = Dispatcher(disable_fsm=True)
+        dp.update.outer_middleware.register(scheduler)
+        dp.update.outer_middleware.register(ErrorsMiddleware(dp))
+        caught = []
+
+        @dp.message()
+        async def handler(message: Message):
+            raise ValueError(message.text)
+
+        @dp.errors()
+        async def on_error(event: ErrorEvent):
+            caught.append(str(event.exception))
+
+        message = {'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+                   'from': {'id': 1, 'is_bot': False, 'first_name': 'user'}}
+        bot = Bot('1:test')
+        await dp.feed_update(bot, Update(update_id=1, message={**message, 'text': 'handled'}))
+        await scheduler.close()
+        await bot.session.close()
+        return caught, scheduler.stats
+
+    caught, stats = asyncio.run(asyncio.wait_for(run(), 10))
+    assert caught == ['handled']
+    assert stats == {'processed': 1, 'shed': 0, 'errors': 0}